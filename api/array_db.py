@@ -0,0 +1,235 @@
+import numpy as np
+
+from db import Database, Lookups, sort_moves
+from uci import UNKNOWN_UCI, decode_uci
+
+
+def compact(values, dtype=None):
+    """Store counts in the smallest unsigned type that holds them."""
+    array = np.asarray(values, dtype=dtype)
+    if array.dtype.kind in "iu" and array.size and array.min() >= 0:
+        return array.astype(np.min_scalar_type(int(array.max())))
+    return array
+
+
+def split_blobs(hash_blobs):
+    keys = np.frombuffer(b"".join(hash_blobs), dtype="<u8").reshape(-1, 2)
+    return keys[:, 0], keys[:, 1]
+
+
+class ArrayDatabase(Lookups):
+    """
+    In-memory model backed by NumPy arrays. Positions are sorted by their
+    128-bit key (hi, lo) with parallel stat columns; lookups are binary
+    searches. Child moves are stored CSR-style: the edges of position row i
+    are move rows move_offsets[i]:move_offsets[i + 1], each pointing to the
+    child's position row, an index into the SAN string pool and the move's
+    packed UCI (uci.encode_uci, 0 where unknown).
+    Start positions of moves that have no chessPosition row themselves are
+    kept in a second sorted key list (start_hi, start_lo) and own the rows
+    after the positions in move_offsets, so their moves are found like in
+    Database. Moves whose end position has no row are dropped, like the
+    JOIN in Database.get_next_moves_by_blob.
+    """
+
+    def __init__(self, file):
+        database = Database(file)
+        try:
+            self.load_positions(database)
+            self.load_moves(database)
+        finally:
+            database.close()
+        print(
+            f"Loaded {len(self.key_hi)} positions and {len(self.move_child)} moves "
+            f"into memory ({self.nbytes() / 1024 / 1024:.1f} MiB)"
+        )
+
+    def load_positions(self, database):
+        rows = [row for batch in database.iter_position_rows() for row in batch]
+        lo, hi = split_blobs([row[0] for row in rows])
+        order = np.lexsort((lo, hi))
+        columns = list(zip(*rows))[1:] if rows else [()] * 6
+        self.key_lo = lo[order].copy()
+        self.key_hi = hi[order].copy()
+        self.times_played = compact(columns[0], np.int64)[order]
+        self.white_wins = compact(columns[1], np.int64)[order]
+        self.black_wins = compact(columns[2], np.int64)[order]
+        self.recursive_white = np.asarray(columns[3], dtype=np.float64)[order]
+        self.recursive_black = np.asarray(columns[4], dtype=np.float64)[order]
+        self.elo = compact(columns[5], np.int64)[order]
+
+    def load_moves(self, database):
+        rows = [row for batch in database.iter_move_rows() for row in batch]
+        count = len(self.key_hi)
+        if rows:
+            starts, ends, sans, times, elos, ucis = zip(*rows)
+            start_rows = self.find_rows(starts)
+            child_rows = self.find_rows(ends)
+            keep = child_rows >= 0
+            # Start positions without a row of their own, numbered after the positions
+            unstored = keep & (start_rows < 0)
+            lo, hi = split_blobs(list(dict.fromkeys(np.asarray(starts, dtype=object)[unstored])))
+            order = np.lexsort((lo, hi))
+            self.start_lo = lo[order].copy()
+            self.start_hi = hi[order].copy()
+            start_rows[unstored] = count + self.find_rows(
+                np.asarray(starts, dtype=object)[unstored], self.start_hi, self.start_lo
+            )
+            count += len(self.start_hi)
+            self.san_pool, san_index = np.unique(np.asarray(sans, dtype=object)[keep], return_inverse=True)
+            start_rows = start_rows[keep]
+            order = np.argsort(start_rows, kind="stable")
+            self.move_child = compact(child_rows[keep][order])
+            self.move_san = compact(san_index[order])
+            self.move_times_played = compact(np.asarray(times, dtype=np.int64)[keep][order])
+            self.move_elo = compact(np.asarray(elos, dtype=np.int64)[keep][order])
+            ucis = [UNKNOWN_UCI if uci is None else uci for uci in ucis]
+            self.move_uci = compact(np.asarray(ucis, dtype=np.int64)[keep][order])
+            counts = np.bincount(start_rows, minlength=count)
+        else:
+            self.san_pool = np.array([], dtype=object)
+            self.move_child = self.move_san = np.array([], dtype=np.uint8)
+            self.move_times_played = self.move_elo = self.move_uci = np.array([], dtype=np.uint8)
+            self.start_hi = self.start_lo = np.array([], dtype=np.uint64)
+            counts = np.zeros(count, dtype=np.int64)
+        self.move_offsets = compact(np.concatenate(([0], np.cumsum(counts))))
+
+    def nbytes(self):
+        return sum(
+            value.nbytes
+            for value in vars(self).values()
+            if isinstance(value, np.ndarray) and value.dtype != object
+        )
+
+    def find_rows(self, hash_blobs, key_hi=None, key_lo=None):
+        """
+        Row for each hash in sorted keys (default: the positions), or -1
+        where it is not in the model.
+        """
+        if key_hi is None:
+            key_hi, key_lo = self.key_hi, self.key_lo
+        if not len(hash_blobs):
+            return np.array([], dtype=np.int64)
+        lo, hi = split_blobs(hash_blobs)
+        left = np.searchsorted(key_hi, hi, side="left")
+        right = np.searchsorted(key_hi, hi, side="right")
+        rows = np.minimum(left, max(len(key_hi) - 1, 0))
+        found = (left < right) & (key_lo[rows] == lo) if len(key_hi) else left < right
+        result = np.where(found, rows, -1)
+        # Keys sharing their high word are sorted by the low word
+        for i in np.nonzero(~found & (right - left > 1))[0]:
+            offset = np.searchsorted(key_lo[left[i] : right[i]], lo[i])
+            if offset < right[i] - left[i] and key_lo[left[i] + offset] == lo[i]:
+                result[i] = left[i] + offset
+        return result
+
+    def find_row(self, hash_blob):
+        return int(self.find_rows([hash_blob])[0])
+
+    def find_move_rows(self, hash_blobs):
+        """move_offsets row for each hash, or -1 where it has no moves."""
+        rows = self.find_rows(hash_blobs)
+        missing = np.nonzero(rows < 0)[0]
+        if len(missing) and len(self.start_hi):
+            starts = self.find_rows([hash_blobs[i] for i in missing], self.start_hi, self.start_lo)
+            rows[missing] = np.where(starts >= 0, starts + len(self.key_hi), -1)
+        return rows
+
+    def position_blob(self, row):
+        if row >= len(self.key_hi):
+            row -= len(self.key_hi)
+            return int(self.start_lo[row]).to_bytes(8, "little") + int(self.start_hi[row]).to_bytes(8, "little")
+        return int(self.key_lo[row]).to_bytes(8, "little") + int(self.key_hi[row]).to_bytes(8, "little")
+
+    def position_at(self, row):
+        return {
+            "positionID": self.position_blob(row),
+            "timesPlayed": int(self.times_played[row]),
+            "whiteWins": int(self.white_wins[row]),
+            "blackWins": int(self.black_wins[row]),
+            "recursiveScoreWhite": float(self.recursive_white[row]),
+            "recursiveScoreBlack": float(self.recursive_black[row]),
+            "elo": int(self.elo[row]),
+        }
+
+    def moves_at(self, row):
+        moves = []
+        for edge in range(int(self.move_offsets[row]), int(self.move_offsets[row + 1])):
+            child = int(self.move_child[edge])
+            moves.append(
+                {
+                    "positionID": self.position_blob(child),
+                    "timesPlayed": int(self.times_played[child]),
+                    "whiteWins": int(self.white_wins[child]),
+                    "blackWins": int(self.black_wins[child]),
+                    "recursiveScoreWhite": float(self.recursive_white[child]),
+                    "recursiveScoreBlack": float(self.recursive_black[child]),
+                    "move_times_played": int(self.move_times_played[edge]),
+                    "moveSAN": self.san_pool[self.move_san[edge]],
+                    "elo": int(self.move_elo[edge]),
+                    "moveUCI": decode_uci(int(self.move_uci[edge])),
+                }
+            )
+        return moves
+
+    def get_position_by_blob(self, hash_blob):
+        row = self.find_row(hash_blob)
+        if row < 0:
+            return None
+        return self.position_at(row)
+
+    def get_positions_by_blobs(self, hash_blobs):
+        unique = list(dict.fromkeys(hash_blobs))
+        rows = self.find_rows(unique)
+        return {
+            hash_blob: self.position_at(int(row))
+            for hash_blob, row in zip(unique, rows)
+            if row >= 0
+        }
+
+    def get_next_moves_by_blob(self, hash_blob):
+        row = int(self.find_move_rows([hash_blob])[0])
+        if row < 0:
+            return None
+        return self.moves_at(row) or None
+
+    def get_next_moves_by_blobs(self, hash_blobs):
+        unique = list(dict.fromkeys(hash_blobs))
+        rows = self.find_move_rows(unique)
+        moves = {}
+        for hash_blob, row in zip(unique, rows):
+            if row >= 0 and self.move_offsets[row] < self.move_offsets[row + 1]:
+                moves[hash_blob] = self.moves_at(int(row))
+        return moves
+
+    def get_position_with_moves_by_blob(self, hash_blob, sort=None, limit=None):
+        row = int(self.find_move_rows([hash_blob])[0])
+        if row < 0:
+            return None, []
+        position = self.position_at(row) if row < len(self.key_hi) else None
+        return position, sort_moves(self.moves_at(row), sort, limit)
+
+    def count_positions(self):
+        return len(self.key_hi)
+
+    def count_moves(self):
+        return len(self.move_child)
+
+    def start_rows(self):
+        """move_offsets rows that have moves."""
+        return np.nonzero(np.diff(self.move_offsets.astype(np.int64)))[0]
+
+    def count_move_starts(self):
+        return len(self.start_rows())
+
+    def iter_position_ids(self, batch_size=65536):
+        for start in range(0, len(self.key_hi), batch_size):
+            yield [self.position_blob(row) for row in range(start, min(start + batch_size, len(self.key_hi)))]
+
+    def iter_move_starts(self, batch_size=65536):
+        starts = self.start_rows()
+        for start in range(0, len(starts), batch_size):
+            yield [self.position_blob(row) for row in starts[start : start + batch_size]]
+
+    def close(self):
+        pass
@@ -0,0 +1,47 @@
+import argparse
+import random
+import time
+
+import chess
+from chess_hash import batch2ints, fen2hash, fen2hash_batch
+
+
+def random_fens(count, seed):
+    rng = random.Random(seed)
+    fens = []
+    while len(fens) < count:
+        board = chess.Board()
+        while not board.is_game_over() and len(fens) < count and board.ply() < 120:
+            board.push(rng.choice(list(board.legal_moves)))
+            fens.append(board.fen())
+    return fens
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare fen2hash against fen2hash_batch.")
+    parser.add_argument("--positions", type=int, default=100000)
+    parser.add_argument("--rating", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"Generating {args.positions} positions...")
+    fens = random_fens(args.positions, args.seed)
+
+    start = time.perf_counter()
+    single = [fen2hash(fen, args.rating) for fen in fens]
+    single_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch = fen2hash_batch(fens, args.rating)
+    batch_time = time.perf_counter() - start
+
+    if batch2ints(batch) != single:
+        raise SystemExit("Batch hashes differ from fen2hash")
+
+    print(f"fen2hash:       {len(fens) / single_time:12.0f} positions/s")
+    print(f"fen2hash_batch: {len(fens) / batch_time:12.0f} positions/s")
+    print(f"Speedup:        {single_time / batch_time:12.1f}x")
+
+
+if __name__ == "__main__":
+    main()
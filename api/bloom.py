@@ -0,0 +1,223 @@
+import math
+import os
+import struct
+
+import numpy as np
+
+from db import Lookups
+
+MASK64 = 0xFFFFFFFFFFFFFFFF
+SIDECAR_MAGIC = b"CSSBLOOM"
+SIDECAR_VERSION = 1
+# magic, version, model size, model mtime (ns)
+SIDECAR_HEADER = struct.Struct("<8sIQQ")
+# bit count, hash count, item count
+FILTER_HEADER = struct.Struct("<QQQ")
+
+
+class BloomFilter:
+    """
+    Bloom filter over 16-byte position hashes. The keys are already uniformly
+    random Zobrist hashes, so the probe positions are derived from their two
+    64-bit halves by double hashing instead of hashing them again. The bits
+    live in one bytearray: probes index it directly, builds update it in
+    place through a NumPy view.
+    """
+
+    def __init__(self, bit_count, hash_count, item_count=0, bits=None):
+        self.bit_count = bit_count
+        self.hash_count = hash_count
+        self.item_count = item_count
+        if bits is None:
+            bits = bytearray((bit_count + 7) // 8)
+        self.bits = bits
+
+    @classmethod
+    def for_items(cls, item_count, fp_rate, max_bytes):
+        """Size a filter for item_count keys, capped at max_bytes of bits."""
+        item_count = max(item_count, 1)
+        bit_count = math.ceil(-item_count * math.log(fp_rate) / math.log(2) ** 2)
+        bit_count = max(min(bit_count, max_bytes * 8), 64)
+        hash_count = max(round(bit_count / item_count * math.log(2)), 1)
+        return cls(bit_count, hash_count)
+
+    def add_blobs(self, hash_blobs):
+        keys = np.frombuffer(b"".join(hash_blobs), dtype="<u8").reshape(-1, 2)
+        lo = keys[:, 0]
+        hi = keys[:, 1]
+        bits = np.frombuffer(self.bits, dtype=np.uint8)
+        for i in range(self.hash_count):
+            index = (lo + np.uint64(i) * hi) % np.uint64(self.bit_count)
+            np.bitwise_or.at(
+                bits,
+                (index >> np.uint64(3)).astype(np.intp),
+                (np.uint8(1) << (index & np.uint64(7)).astype(np.uint8)),
+            )
+        self.item_count += len(hash_blobs)
+
+    def __contains__(self, hash_blob):
+        lo = int.from_bytes(hash_blob[:8], "little")
+        hi = int.from_bytes(hash_blob[8:], "little")
+        bits = self.bits
+        for i in range(self.hash_count):
+            index = ((lo + i * hi) & MASK64) % self.bit_count
+            if not bits[index >> 3] & (1 << (index & 7)):
+                return False
+        return True
+
+    def fp_rate(self):
+        """Expected false-positive rate at the current fill."""
+        fill = 1 - math.exp(-self.hash_count * self.item_count / self.bit_count)
+        return fill ** self.hash_count
+
+    def stats(self):
+        return {
+            "items": self.item_count,
+            "bytes": len(self.bits),
+            "hashCount": self.hash_count,
+            "expectedFpRate": self.fp_rate(),
+        }
+
+    def write(self, f):
+        f.write(FILTER_HEADER.pack(self.bit_count, self.hash_count, self.item_count))
+        f.write(self.bits)
+
+    @classmethod
+    def read(cls, f):
+        """A filter written by write(), or None if the file is cut short."""
+        bit_count, hash_count, item_count = FILTER_HEADER.unpack(f.read(FILTER_HEADER.size))
+        bits = bytearray((bit_count + 7) // 8)
+        if f.readinto(bits) != len(bits):
+            return None
+        return cls(bit_count, hash_count, item_count, bits)
+
+
+def model_signature(model_file):
+    stat = os.stat(model_file)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def load_filters(sidecar_file, model_file):
+    """Return (positions, move_starts) from a sidecar file, or None if stale or truncated."""
+    try:
+        with open(sidecar_file, "rb") as f:
+            magic, version, size, mtime = SIDECAR_HEADER.unpack(f.read(SIDECAR_HEADER.size))
+            if (magic, version) != (SIDECAR_MAGIC, SIDECAR_VERSION):
+                return None
+            if (size, mtime) != model_signature(model_file):
+                return None
+            positions = BloomFilter.read(f)
+            move_starts = BloomFilter.read(f)
+            if positions is None or move_starts is None:
+                return None
+            return positions, move_starts
+    except (OSError, struct.error):
+        return None
+
+
+def save_filters(sidecar_file, model_file, positions, move_starts):
+    """
+    Write the sidecar aside and move it into place, so API workers building
+    the same sidecar at once never read each other's half-written file.
+    """
+    size, mtime = model_signature(model_file)
+    temp_file = f"{sidecar_file}.{os.getpid()}.tmp"
+    try:
+        with open(temp_file, "wb") as f:
+            f.write(SIDECAR_HEADER.pack(SIDECAR_MAGIC, SIDECAR_VERSION, size, mtime))
+            positions.write(f)
+            move_starts.write(f)
+        os.replace(temp_file, sidecar_file)
+    except OSError:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
+
+
+def build_filters(database, fp_rate, max_bytes):
+    """Build filters over all positionIDs and move start positions."""
+    positions = BloomFilter.for_items(database.count_positions(), fp_rate, max_bytes // 2)
+    for hash_blobs in database.iter_position_ids():
+        positions.add_blobs(hash_blobs)
+    move_starts = BloomFilter.for_items(database.count_move_starts(), fp_rate, max_bytes // 2)
+    for hash_blobs in database.iter_move_starts():
+        move_starts.add_blobs(hash_blobs)
+    return positions, move_starts
+
+
+class BloomFilteredDatabase(Lookups):
+    """
+    Answers guaranteed misses without touching the wrapped database: a hash
+    not in the position filter has no chessPosition row, and one not in the
+    move-start filter has no chessMove rows.
+    """
+
+    def __init__(self, database, positions, move_starts):
+        self.database = database
+        self.positions = positions
+        self.move_starts = move_starts
+        self.skipped = 0
+
+    @classmethod
+    def from_model(cls, database, model_file, fp_rate, max_bytes, sidecar_file=None):
+        if sidecar_file is None:
+            sidecar_file = model_file + ".bloom"
+        filters = load_filters(sidecar_file, model_file)
+        if filters is None:
+            print(f"Building bloom filters for {model_file}...")
+            filters = build_filters(database, fp_rate, max_bytes)
+            try:
+                save_filters(sidecar_file, model_file, *filters)
+            except OSError as e:
+                print(f"Could not write bloom filter sidecar {sidecar_file}: {e}")
+        return cls(database, *filters)
+
+    def __getattr__(self, name):
+        return getattr(self.database, name)
+
+    def get_position_by_blob(self, hash_blob):
+        if hash_blob not in self.positions:
+            self.skipped += 1
+            return None
+        return self.database.get_position_by_blob(hash_blob)
+
+    def get_positions_by_blobs(self, hash_blobs):
+        candidates = [b for b in hash_blobs if b in self.positions]
+        self.skipped += len(hash_blobs) - len(candidates)
+        if not candidates:
+            return {}
+        return self.database.get_positions_by_blobs(candidates)
+
+    def get_next_moves_by_blob(self, hash_blob):
+        if hash_blob not in self.move_starts:
+            self.skipped += 1
+            return None
+        return self.database.get_next_moves_by_blob(hash_blob)
+
+    def get_next_moves_by_blobs(self, hash_blobs):
+        candidates = [b for b in hash_blobs if b in self.move_starts]
+        self.skipped += len(hash_blobs) - len(candidates)
+        if not candidates:
+            return {}
+        return self.database.get_next_moves_by_blobs(candidates)
+
+    def get_position_with_moves_by_blob(self, hash_blob, sort=None, limit=None):
+        if hash_blob not in self.positions and hash_blob not in self.move_starts:
+            self.skipped += 1
+            return None, []
+        return self.database.get_position_with_moves_by_blob(hash_blob, sort, limit)
+
+    def select_move_by_blob(self, hash_blob, strategy, white_to_move, point, min_play_rate=0.0):
+        if hash_blob not in self.move_starts:
+            self.skipped += 1
+            return None
+        return self.database.select_move_by_blob(
+            hash_blob, strategy, white_to_move, point, min_play_rate
+        )
+
+    def stats(self):
+        return {
+            "skipped": self.skipped,
+            "positions": self.positions.stats(),
+            "moveStarts": self.move_starts.stats(),
+        }
@@ -0,0 +1,89 @@
+import argparse
+import os
+import sqlite3
+
+import chess
+from chess_hash import fen2band_blobs
+from db import QUERY_CHUNK, Database
+from uci import UCI_SCHEMA, encode_uci, uci_sidecar
+
+INSERT_BATCH = 65536
+
+
+def walk_edges(database):
+    """
+    Breadth-first walk of the move graph from the start position of every
+    rating band, yielding (startPosition, endPosition, uci) per edge. Each
+    position is expanded once with the FEN it was first reached by, so SAN
+    is parsed once per edge. Edges not reachable from the start position
+    are not yielded.
+    """
+    frontier = {blob: chess.STARTING_FEN for blob in fen2band_blobs(chess.STARTING_FEN).values()}
+    visited = set(frontier)
+    while frontier:
+        next_frontier = {}
+        blobs = list(frontier)
+        for start in range(0, len(blobs), QUERY_CHUNK):
+            chunk = blobs[start : start + QUERY_CHUNK]
+            next_moves = database.get_next_moves_by_blobs(chunk)
+            for parent_blob in chunk:
+                moves = next_moves.get(parent_blob)
+                if not moves:
+                    continue
+                board = chess.Board(frontier[parent_blob])
+                for move in moves:
+                    try:
+                        parsed = board.parse_san(move["moveSAN"])
+                    except ValueError:
+                        continue
+                    child_blob = move["positionID"]
+                    yield parent_blob, child_blob, encode_uci(parsed)
+                    if child_blob not in visited:
+                        visited.add(child_blob)
+                        board.push(parsed)
+                        next_frontier[child_blob] = board.fen()
+                        board.pop()
+        frontier = next_frontier
+
+
+def write_sidecar(edges, file):
+    """Write edges to a fresh moveUCI table. Returns the number of edges."""
+    if os.path.exists(file):
+        os.remove(file)
+    connection = sqlite3.connect(file)
+    connection.execute(f"CREATE TABLE moveUCI ({UCI_SCHEMA}) WITHOUT ROWID")
+    count = 0
+    batch = []
+    for edge in edges:
+        batch.append(edge)
+        if len(batch) >= INSERT_BATCH:
+            connection.executemany("INSERT OR IGNORE INTO moveUCI VALUES (?, ?, ?)", batch)
+            count += len(batch)
+            batch = []
+    connection.executemany("INSERT OR IGNORE INTO moveUCI VALUES (?, ?, ?)", batch)
+    count += len(batch)
+    connection.commit()
+    connection.close()
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Precompute the UCI of every move of a model into a <model>.uci sidecar."
+    )
+    parser.add_argument("input", help="SQLite model, e.g. ../models/results.sqlite")
+    parser.add_argument("--output", help="Sidecar to write (default: <input>.uci)")
+    args = parser.parse_args()
+
+    output = args.output or uci_sidecar(args.input)
+    database = Database(args.input)
+    try:
+        count = write_sidecar(walk_edges(database), output)
+        total = database.count_moves()
+    finally:
+        database.close()
+    print(f"Wrote UCI for {count} of {total} moves to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+import sys
+import threading
+from collections import OrderedDict
+
+from db import Lookups, sort_moves
+from selection import select_move
+
+MISSING = object()
+
+
+def entry_size(value):
+    """Rough memory footprint of a cached value in bytes."""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(entry_size(k) + entry_size(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(entry_size(v) for v in value)
+    return size
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache bounded by entry count and estimated bytes.
+    None is a valid cached value; get() returns MISSING for absent keys.
+    """
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return MISSING
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        size = entry_size(key) + entry_size(value)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self.entries[key] = (value, size)
+            self.bytes += size
+            while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "maxEntries": self.max_entries,
+                "maxBytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hitRate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+class CachedDatabase(Lookups):
+    """
+    Caches position and move lookups of a database by their 16-byte hash.
+    The model is read-only, so entries (including misses) never go stale.
+    Methods that are not cached are forwarded to the wrapped database.
+    """
+
+    def __init__(self, database, max_entries, max_bytes):
+        self.database = database
+        self.cache = LRUCache(max_entries, max_bytes)
+
+    def __getattr__(self, name):
+        return getattr(self.database, name)
+
+    def get_position_by_blob(self, hash_blob):
+        position = self.cache.get(("position", hash_blob))
+        if position is MISSING:
+            position = self.database.get_position_by_blob(hash_blob)
+            self.cache.put(("position", hash_blob), position)
+        return position
+
+    def get_positions_by_blobs(self, hash_blobs):
+        positions = {}
+        missing = []
+        for hash_blob in dict.fromkeys(hash_blobs):
+            position = self.cache.get(("position", hash_blob))
+            if position is MISSING:
+                missing.append(hash_blob)
+            elif position is not None:
+                positions[hash_blob] = position
+        if missing:
+            found = self.database.get_positions_by_blobs(missing)
+            for hash_blob in missing:
+                self.cache.put(("position", hash_blob), found.get(hash_blob))
+            positions.update(found)
+        return positions
+
+    def get_next_moves_by_blob(self, hash_blob):
+        moves = self.cache.get(("moves", hash_blob))
+        if moves is MISSING:
+            moves = self.database.get_next_moves_by_blob(hash_blob)
+            self.cache.put(("moves", hash_blob), moves)
+        return moves
+
+    def get_next_moves_by_blobs(self, hash_blobs):
+        moves = {}
+        missing = []
+        for hash_blob in dict.fromkeys(hash_blobs):
+            cached = self.cache.get(("moves", hash_blob))
+            if cached is MISSING:
+                missing.append(hash_blob)
+            elif cached is not None:
+                moves[hash_blob] = cached
+        if missing:
+            found = self.database.get_next_moves_by_blobs(missing)
+            for hash_blob in missing:
+                self.cache.put(("moves", hash_blob), found.get(hash_blob))
+            moves.update(found)
+        return moves
+
+    def get_position_with_moves_by_blob(self, hash_blob, sort=None, limit=None):
+        position = self.cache.get(("position", hash_blob))
+        moves = self.cache.get(("moves", hash_blob))
+        if position is MISSING or moves is MISSING:
+            position, moves = self.database.get_position_with_moves_by_blob(hash_blob)
+            self.cache.put(("position", hash_blob), position)
+            self.cache.put(("moves", hash_blob), moves or None)
+        return position, sort_moves(moves or [], sort, limit)
+
+    def select_move_by_blob(self, hash_blob, strategy, white_to_move, point, min_play_rate=0.0):
+        # Select among cached moves, else let the database select in SQL
+        moves = self.cache.get(("moves", hash_blob))
+        if moves is MISSING:
+            return self.database.select_move_by_blob(
+                hash_blob, strategy, white_to_move, point, min_play_rate
+            )
+        return select_move(moves or [], strategy, white_to_move, point, min_play_rate)
@@ -1,6 +1,8 @@
 # https://github.com/baroxyton/chess-library/blob/noassert_128bhash/src/zobrist.hpp
 # Mithilfe von KI geschrieben
 import chess
+import numpy as np
+
 RANDOM_ARRAY = [
     ((0x3797A0ABC005E436) << 64) | 0x4F8DF6EEA13920BD,
     ((0x2796FB714CE2D11F) << 64) | 0xC1852BFA866FFFF3,
@@ -863,8 +865,7 @@ def castling_hash_index(board: chess.Board) -> int:
     )
 
 
-def fen2hash(fen, rating):
-    board = chess.Board(fen)
+def board_hash(board: chess.Board) -> int:
     hash = 0
 
     for square in chess.SQUARES:
@@ -874,10 +875,7 @@ def fen2hash(fen, rating):
         piece_num = piece2num(board_piece)
         hash ^= piece(piece_num, square)
 
-
-    ep_hash = 0
-    if board.ep_square:
-        ep_hash ^= enpassant(board.ep_square)
+    ep_hash = enpassant_hash(board)
 
     stm_hash = 0
     if board.turn == chess.WHITE:
@@ -885,9 +883,293 @@ def fen2hash(fen, rating):
 
     castling_hash = castling(castling_hash_index(board))
 
-    final_hash = hash ^ ep_hash ^ stm_hash ^ castling_hash
+    return hash ^ ep_hash ^ stm_hash ^ castling_hash
+
+
+def fen2hash(fen, rating):
+    board = chess.Board(fen)
+    return hash_add_rating(board_hash(board), rating)
+
+
+# Only legal en passant squares are hashed, matching what board.fen() writes
+def enpassant_hash(board: chess.Board) -> int:
+    if board.ep_square is not None and board.has_legal_en_passant():
+        return enpassant(chess.square_file(board.ep_square))
+    return 0
+
+
+def castling_rights_index(rights: int) -> int:
+    return (
+        int(bool(rights & chess.BB_H1)) +
+        2 * int(bool(rights & chess.BB_A1)) +
+        4 * int(bool(rights & chess.BB_H8)) +
+        8 * int(bool(rights & chess.BB_A8))
+    )
+
+
+def move_hash(parent_hash: int, board: chess.Board, move: chess.Move, check=False) -> int:
+    """
+    Incrementally compute the hash of the position after `move`.
+    `parent_hash` is the (optionally rated) hash of `board`, which must be the
+    position before the move. Only the keys that change are XORed, so the
+    rating key carries over. With check=True the result is verified against a
+    full board_hash of the child position.
+    """
+    turn = board.turn
+    from_square = move.from_square
+    to_square = move.to_square
+    moving = board.piece_at(from_square)
+    moving_num = piece2num(moving)
+
+    delta = side_to_move() ^ enpassant_hash(board)
+    delta ^= piece(moving_num, from_square)
+
+    if board.is_castling(move):
+        rank = chess.square_rank(from_square)
+        kingside = board.is_kingside_castling(move)
+        if board.rooks & board.occupied_co[turn] & chess.BB_SQUARES[to_square]:
+            rook_from = to_square
+        else:
+            rook_from = chess.square(7 if kingside else 0, rank)
+        rook_num = piece2num(chess.Piece(chess.ROOK, turn))
+        delta ^= piece(rook_num, rook_from)
+        delta ^= piece(rook_num, chess.square(5 if kingside else 3, rank))
+        delta ^= piece(moving_num, chess.square(6 if kingside else 2, rank))
+    else:
+        capture_square = to_square
+        if board.is_en_passant(move):
+            capture_square = to_square - 8 if turn == chess.WHITE else to_square + 8
+        captured = board.piece_at(capture_square)
+        if captured:
+            delta ^= piece(piece2num(captured), capture_square)
+        if move.promotion:
+            moving_num = piece2num(chess.Piece(move.promotion, turn))
+        delta ^= piece(moving_num, to_square)
+
+    rights = board.clean_castling_rights()
+    child_rights = rights & ~chess.BB_SQUARES[from_square] & ~chess.BB_SQUARES[to_square]
+    if moving.piece_type == chess.KING:
+        child_rights &= ~(chess.BB_RANK_1 if turn == chess.WHITE else chess.BB_RANK_8)
+    delta ^= castling(castling_rights_index(rights))
+    delta ^= castling(castling_rights_index(child_rights))
+
+    # A double push only yields an ep key if the opponent can actually capture
+    if moving.piece_type == chess.PAWN and abs(to_square - from_square) == 16:
+        ep_square = (from_square + to_square) // 2
+        if board.pawns & board.occupied_co[not turn] & chess.BB_PAWN_ATTACKS[turn][ep_square]:
+            child = board.copy(stack=False)
+            child.push(move)
+            delta ^= enpassant_hash(child)
+
+    child_hash = parent_hash ^ delta
+
+    if check:
+        child = board.copy(stack=False)
+        child.push(move)
+        if child_hash ^ board_hash(child) != parent_hash ^ board_hash(board):
+            raise ValueError(f"Incremental hash mismatch for {move.uci()} in {board.fen()}")
+
+    return child_hash
+
+
+# Fast path for single FENs: keys indexed by piece character and placement
+# index in FEN order (a8 first), split into 64-bit halves.
+FEN_PIECES = "PNBRQKpnbrqk"
+FEN_SQUARES = [chess.square(i % 8, 7 - i // 8) for i in range(64)]
+FEN_KEYS_LO = {
+    char: [piece(num, sq) & 0xFFFFFFFFFFFFFFFF for sq in FEN_SQUARES]
+    for num, char in enumerate(FEN_PIECES)
+}
+FEN_KEYS_HI = {
+    char: [piece(num, sq) >> 64 for sq in FEN_SQUARES]
+    for num, char in enumerate(FEN_PIECES)
+}
+CASTLING_KEYS_LO = [key & 0xFFFFFFFFFFFFFFFF for key in castling_key]
+CASTLING_KEYS_HI = [key >> 64 for key in castling_key]
+STM_KEY_LO = side_to_move() & 0xFFFFFFFFFFFFFFFF
+STM_KEY_HI = side_to_move() >> 64
+RATING_KEYS_LO = [key & 0xFFFFFFFFFFFFFFFF for key in RATING_ARRAY]
+RATING_KEYS_HI = [key >> 64 for key in RATING_ARRAY]
+_EXPAND_FEN_DIGITS = str.maketrans({str(n): "." * n for n in range(1, 9)} | {"/": None})
+# (castling bit, placement index of king, placement index of rook, king, rook)
+FEN_CASTLING = [
+    ("K", 1, 60, 63, "K", "R"),
+    ("Q", 2, 60, 56, "K", "R"),
+    ("k", 4, 4, 7, "k", "r"),
+    ("q", 8, 4, 0, "k", "r"),
+]
+
+
+def fen2blob(fen, rating):
+    """
+    Same hash as fen2hash, returned as the 16-byte little-endian positionID
+    blob. Parses the FEN fields directly instead of building a chess.Board;
+    only FENs with an en passant square or non-standard castling field need
+    the board to decide the ep/castling keys.
+    """
+    lo, hi = fen_key_halves(fen)
+    lo ^= RATING_KEYS_LO[rating]
+    hi ^= RATING_KEYS_HI[rating]
+    return lo.to_bytes(8, "little") + hi.to_bytes(8, "little")
+
+
+def fen2band_blobs(fen, ratings=None):
+    """fen2blob for several rating bands (default: all), parsing the FEN once."""
+    if ratings is None:
+        ratings = range(len(RATING_ARRAY))
+    lo, hi = fen_key_halves(fen)
+    return {
+        rating: (lo ^ RATING_KEYS_LO[rating]).to_bytes(8, "little")
+        + (hi ^ RATING_KEYS_HI[rating]).to_bytes(8, "little")
+        for rating in ratings
+    }
+
+
+def fen_key_halves(fen):
+    """Unrated hash of a FEN as (lo, hi) 64-bit halves."""
+    fields = fen.split()
+    placement = fields[0].translate(_EXPAND_FEN_DIGITS)
+    if len(placement) != 64:
+        raise ValueError(f"Invalid piece placement in FEN: {fen!r}")
+
+    lo = 0
+    hi = 0
+    try:
+        for i, char in enumerate(placement):
+            if char != ".":
+                lo ^= FEN_KEYS_LO[char][i]
+                hi ^= FEN_KEYS_HI[char][i]
+    except KeyError:
+        raise ValueError(f"Invalid piece in FEN: {fen!r}")
+
+    turn = fields[1] if len(fields) > 1 else "w"
+    rights = fields[2] if len(fields) > 2 else "-"
+    ep = fields[3] if len(fields) > 3 else "-"
+    if turn == "w":
+        lo ^= STM_KEY_LO
+        hi ^= STM_KEY_HI
+
+    if ep != "-" or rights.strip("KQkq-"):
+        board = chess.Board(fen)
+        key = castling(castling_hash_index(board)) ^ enpassant_hash(board)
+        lo ^= key & 0xFFFFFFFFFFFFFFFF
+        hi ^= key >> 64
+    else:
+        index = 0
+        for char, bit, king_at, rook_at, king, rook in FEN_CASTLING:
+            if char in rights and placement[king_at] == king and placement[rook_at] == rook:
+                index |= bit
+        lo ^= CASTLING_KEYS_LO[index]
+        hi ^= CASTLING_KEYS_HI[index]
+
+    return lo, hi
+
+
+# Batch hashing: the 128-bit keys are split into (lo, hi) uint64 columns so a
+# whole batch can be XOR-reduced with NumPy. Row 12 of the piece-square table
+# is an all-zero key for empty squares.
+EMPTY_SQUARE = 12
+BATCH_CHUNK = 65536
+
+
+def split_keys(keys):
+    return np.array([(k & 0xFFFFFFFFFFFFFFFF, k >> 64) for k in keys], dtype=np.uint64)
+
+
+PIECE_SQUARE_KEYS = np.zeros((13, 64, 2), dtype=np.uint64)
+for _piece_num in range(12):
+    PIECE_SQUARE_KEYS[_piece_num] = split_keys(piece(_piece_num, sq) for sq in chess.SQUARES)
+CASTLING_KEYS = split_keys(castling_key)
+ENPASSANT_KEYS = np.vstack([split_keys(enpassant(f) for f in range(8)), np.zeros((1, 2), dtype=np.uint64)])
+SIDE_TO_MOVE_KEYS = np.vstack([np.zeros((1, 2), dtype=np.uint64), split_keys([side_to_move()])])
+RATING_KEYS = split_keys(RATING_ARRAY)
+
+_FEN_SQUARE_CODES = np.full(256, 255, dtype=np.uint8)
+_FEN_SQUARE_CODES[ord(".")] = EMPTY_SQUARE
+for _piece_num, _char in enumerate(FEN_PIECES):
+    _FEN_SQUARE_CODES[ord(_char)] = _piece_num
+_CASTLING_BITS = {"K": 1, "Q": 2, "k": 4, "q": 8}
+
+
+def pack_fens(fens):
+    """
+    Parse FENs into packed boards for hash_packed: a (N, 64) uint8 array of
+    piece numbers (EMPTY_SQUARE for empty squares), and per-board side to move,
+    castling index and en passant file (8 for none).
+    FENs with an en passant square or non-standard castling field fall back to
+    chess.Board so the result stays identical to fen2hash.
+    """
+    count = len(fens)
+    placements = []
+    white_to_move = np.zeros(count, dtype=bool)
+    castling_idx = np.zeros(count, dtype=np.uint8)
+    ep_file = np.full(count, 8, dtype=np.uint8)
+
+    for i, fen in enumerate(fens):
+        fields = fen.split()
+        placements.append(fields[0].translate(_EXPAND_FEN_DIGITS))
+        white_to_move[i] = len(fields) < 2 or fields[1] == "w"
+        rights = fields[2] if len(fields) > 2 else "-"
+        ep = fields[3] if len(fields) > 3 else "-"
+        if ep != "-" or rights.strip("KQkq-"):
+            board = chess.Board(fen)
+            castling_idx[i] = castling_hash_index(board)
+            ep_key = enpassant_hash(board)
+            if ep_key:
+                ep_file[i] = chess.square_file(board.ep_square)
+            continue
+        for char in rights:
+            castling_idx[i] |= _CASTLING_BITS.get(char, 0)
+
+    raw = np.frombuffer("".join(placements).encode("ascii"), dtype=np.uint8)
+    if raw.size != 64 * count:
+        raise ValueError("Invalid piece placement in FEN batch")
+    squares = _FEN_SQUARE_CODES[raw].reshape(count, 8, 8)[:, ::-1, :].reshape(count, 64)
+    if (squares == 255).any():
+        raise ValueError("Invalid piece in FEN batch")
+
+    # Drop castling rights whose king or rook is not in place, like clean_castling_rights()
+    white_king = squares[:, chess.E1] == 5
+    black_king = squares[:, chess.E8] == 11
+    castling_idx &= np.where(white_king & (squares[:, chess.H1] == 3), 0xF, 0xE).astype(np.uint8)
+    castling_idx &= np.where(white_king & (squares[:, chess.A1] == 3), 0xF, 0xD).astype(np.uint8)
+    castling_idx &= np.where(black_king & (squares[:, chess.H8] == 9), 0xF, 0xB).astype(np.uint8)
+    castling_idx &= np.where(black_king & (squares[:, chess.A8] == 9), 0xF, 0x7).astype(np.uint8)
+
+    return squares, white_to_move, castling_idx, ep_file
+
+
+def hash_packed(squares, white_to_move, castling_idx, ep_file, rating):
+    """
+    Hash packed boards (see pack_fens). `rating` is a band index or an array
+    with one band per board. Returns a (N, 2) uint64 array of (lo, hi) words;
+    each row's little-endian bytes are the 16-byte positionID blob.
+    """
+    count = len(squares)
+    ratings = np.broadcast_to(np.asarray(rating, dtype=np.intp), (count,))
+    result = np.empty((count, 2), dtype=np.uint64)
+    square_range = np.arange(64)
+
+    for start in range(0, count, BATCH_CHUNK):
+        end = min(start + BATCH_CHUNK, count)
+        keys = PIECE_SQUARE_KEYS[squares[start:end], square_range]
+        chunk = np.bitwise_xor.reduce(keys, axis=1)
+        chunk ^= CASTLING_KEYS[castling_idx[start:end]]
+        chunk ^= ENPASSANT_KEYS[ep_file[start:end]]
+        chunk ^= SIDE_TO_MOVE_KEYS[white_to_move[start:end].astype(np.intp)]
+        chunk ^= RATING_KEYS[ratings[start:end]]
+        result[start:end] = chunk
+
+    return result
+
+
+def fen2hash_batch(fens, rating):
+    return hash_packed(*pack_fens(fens), rating)
 
-    return hash_add_rating(final_hash, rating)
 
+def batch2ints(hashes):
+    return [(int(hi) << 64) | int(lo) for lo, hi in hashes]
 
 
+def batch2blobs(hashes):
+    return [row.tobytes() for row in hashes.astype("<u8")]
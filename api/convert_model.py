@@ -0,0 +1,22 @@
+import argparse
+
+from array_db import ArrayDatabase
+from model_file import MappedDatabase, write_model
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert a results.sqlite model into a memory-mappable model file."
+    )
+    parser.add_argument("input", help="SQLite model, e.g. ../models/results.sqlite")
+    parser.add_argument("output", help="Model file to write, e.g. ../models/results.cssm")
+    args = parser.parse_args()
+
+    database = ArrayDatabase(args.input)
+    write_model(database, args.output)
+    mapped = MappedDatabase(args.output)
+    print(f"Rating bands (elo: positions): {mapped.bands}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,88 +1,394 @@
 # KI-generiert
+import os
 import sqlite3
-from chess_hash import fen2hash
+import threading
+from urllib.request import pathname2url
+from chess_hash import fen2band_blobs, fen2blob
+from selection import select_move
+from uci import UCI_SCHEMA, decode_uci, uci_sidecar
 
 FILE = "../models/results.sqlite"
+# Stay below SQLITE_MAX_VARIABLE_NUMBER of older SQLite builds
+QUERY_CHUNK = 500
 
+POSITION_COLUMNS = "positionID, timesPlayed, whiteWins, blackWins, recursiveScoreWhite, recursiveScoreBlack, elo"
+MOVE_COLUMNS = """chessPosition.timesPlayed AS pos_times_played,
+    chessPosition.positionID,
+    chessPosition.whiteWins,
+    chessPosition.blackWins,
+    chessPosition.recursiveScoreWhite,
+    chessPosition.recursiveScoreBlack,
+    chessMove.timesPlayed AS move_times_played,
+    chessMove.moveSAN,
+    chessMove.elo,
+    moveUCI.uci AS move_uci"""
+# moveUCI comes from the <model>.uci sidecar written by build_uci.py
+UCI_JOIN = """LEFT JOIN moveUCI ON moveUCI.startPosition = chessMove.startPosition
+        AND moveUCI.endPosition = chessMove.endPosition"""
+
+# Server-side move orderings: numeric fields sort descending, SAN ascending
+MOVE_SORT_COLUMNS = {
+    "move_times_played": "chessMove.timesPlayed DESC",
+    "timesPlayed": "chessPosition.timesPlayed DESC",
+    "whiteWins": "chessPosition.whiteWins DESC",
+    "blackWins": "chessPosition.blackWins DESC",
+    "recursiveScoreWhite": "chessPosition.recursiveScoreWhite DESC",
+    "recursiveScoreBlack": "chessPosition.recursiveScoreBlack DESC",
+    "moveSAN": "chessMove.moveSAN ASC",
+}
+
+
+# ORDER BY of the deterministic strategies, by side to move (white, black)
+SELECT_ORDER = {
+    "avg_player_deterministic": ("move_times_played DESC", "move_times_played DESC"),
+    "avg_best": (
+        "CAST(whiteWins AS REAL) / pos_times_played DESC",
+        "CAST(whiteWins AS REAL) / pos_times_played ASC",
+    ),
+    "recursive_best": ("recursiveScoreWhite DESC", "recursiveScoreBlack DESC"),
+    "recursive_worst": ("recursiveScoreBlack DESC", "recursiveScoreWhite DESC"),
+}
+
+
+def sort_moves(moves, sort=None, limit=None):
+    """Python equivalent of the ORDER BY/LIMIT of get_position_with_moves."""
+    if sort is not None:
+        moves = sorted(moves, key=lambda move: move[sort], reverse=sort != "moveSAN")
+    if limit is not None:
+        moves = moves[:limit]
+    return moves
+
+
+def position_row(result):
+    return {
+        "positionID": result[0],
+        "timesPlayed": result[1],
+        "whiteWins": result[2],
+        "blackWins": result[3],
+        "recursiveScoreWhite": result[4],
+        "recursiveScoreBlack": result[5],
+        "elo": result[6],
+    }
+
+
+def move_row(row):
+    return {
+        "positionID": row[1],
+        "timesPlayed": row[0],
+        "whiteWins": row[2],
+        "blackWins": row[3],
+        "recursiveScoreWhite": row[4],
+        "recursiveScoreBlack": row[5],
+        "move_times_played": row[6],
+        "moveSAN": row[7],
+        "elo": row[8],
+        "moveUCI": decode_uci(row[9]),
+    }
+
+
+class Lookups:
+    """
+    Hash and FEN variants of the *_by_blob lookups. Database and the
+    wrappers around it implement the blob methods and inherit these.
+    """
 
-class Database:
-    def __init__(self, file=FILE):
+    def get_position(self, position_hash):
+        return self.get_position_by_blob(position_hash.to_bytes(16, byteorder="little"))
+
+    def get_next_moves(self, position_hash):
+        return self.get_next_moves_by_blob(position_hash.to_bytes(16, byteorder="little"))
+
+    def get_position_with_moves(self, position_hash, sort=None, limit=None):
+        return self.get_position_with_moves_by_blob(
+            position_hash.to_bytes(16, byteorder="little"), sort, limit
+        )
+
+    def get_position_by_fen(self, fen, rating):
+        return self.get_position_by_blob(fen2blob(fen, rating))
+
+    def get_next_moves_by_fen(self, fen, rating):
+        return self.get_next_moves_by_blob(fen2blob(fen, rating))
+
+    def get_position_with_moves_by_fen(self, fen, rating, sort=None, limit=None):
+        return self.get_position_with_moves_by_blob(fen2blob(fen, rating), sort, limit)
+
+    def select_move_by_blob(self, hash_blob, strategy, white_to_move, point, min_play_rate=0.0):
+        """Pick one child move with a selection.STRATEGIES strategy."""
+        moves = self.get_next_moves_by_blob(hash_blob) or []
+        return select_move(moves, strategy, white_to_move, point, min_play_rate)
+
+    def select_move_by_fen(self, fen, rating, strategy, point, min_play_rate=0.0):
+        white_to_move = fen.split()[1:2] != ["b"]
+        return self.select_move_by_blob(
+            fen2blob(fen, rating), strategy, white_to_move, point, min_play_rate
+        )
+
+    def get_bands_by_fen(self, fen, ratings=None, children=False):
+        """
+        A position in several rating bands (default: all): one batched lookup
+        for the band positions and, with `children`, one for their moves.
+        Returns {rating: (position or None, moves)}.
+        """
+        blobs = fen2band_blobs(fen, ratings)
+        positions = self.get_positions_by_blobs(list(blobs.values()))
+        next_moves = self.get_next_moves_by_blobs(list(blobs.values())) if children else {}
+        return {
+            rating: (positions.get(blob), next_moves.get(blob, []))
+            for rating, blob in blobs.items()
+        }
+
+
+class Database(Lookups):
+    """
+    Read-only access to a model file. Every thread gets its own connection
+    (opened lazily through `cursor`), so queries can run in parallel from a
+    thread pool. With immutable=True SQLite skips file locking entirely,
+    which is only safe because models are never written while served.
+    """
+
+    def __init__(self, file=FILE, immutable=True):
+        self.immutable = immutable
+        self.local = threading.local()
+        self.connections = []
+        self.lock = threading.Lock()
         self.connect(file)
 
     def connect(self, db_file):
-        self.connection = sqlite3.connect(db_file)
-        self.cursor = self.connection.cursor()
-        # make read-only
-        self.connection.execute("PRAGMA query_only = 1")
+        self.file = db_file
+        self.connection = self.open_connection()
+        self.local.cursor = self.connection.cursor()
         print(f"Connected to database: {db_file}")
 
+    def open_connection(self):
+        uri = f"file:{pathname2url(os.path.abspath(self.file))}?mode=ro"
+        if self.immutable:
+            uri += "&immutable=1"
+        connection = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        uci_file = uci_sidecar(self.file)
+        if os.path.exists(uci_file):
+            connection.execute(
+                "ATTACH DATABASE ? AS uci",
+                (f"file:{pathname2url(os.path.abspath(uci_file))}?mode=ro",),
+            )
+        else:
+            # Same columns, no rows: every moveUCI is NULL
+            connection.execute(f"CREATE TEMP TABLE moveUCI ({UCI_SCHEMA})")
+        # make read-only
+        connection.execute("PRAGMA query_only = 1")
+        with self.lock:
+            self.connections.append(connection)
+        return connection
+
+    @property
+    def cursor(self):
+        cursor = getattr(self.local, "cursor", None)
+        if cursor is None:
+            cursor = self.open_connection().cursor()
+            self.local.cursor = cursor
+        return cursor
+
     def close(self):
-        if self.connection:
-            self.connection.close()
+        with self.lock:
+            connections, self.connections = self.connections, []
+        for connection in connections:
+            connection.close()
+        self.local = threading.local()
+        if connections:
             print("Connection closed.")
 
-    def get_position(self, position_hash):
-        hash_blob = position_hash.to_bytes(16, byteorder="little")
+    def get_position_by_blob(self, hash_blob):
         self.cursor.execute(
-            "SELECT positionID, timesPlayed, whiteWins, blackWins, recursiveScoreWhite, recursiveScoreBlack, elo FROM chessPosition WHERE positionID = ?",
+            f"SELECT {POSITION_COLUMNS} FROM chessPosition WHERE positionID = ?",
             (hash_blob,),
         )
         result = self.cursor.fetchone()
         if result:
-            return {
-                "positionID": result[0],
-                "timesPlayed": result[1],
-                "whiteWins": result[2],
-                "blackWins": result[3],
-                "recursiveScoreWhite": result[4],
-                "recursiveScoreBlack": result[5],
-                "elo": result[6],
-            }
+            return position_row(result)
         return None
 
-    def get_next_moves(self, position_hash):
-        hash_blob = position_hash.to_bytes(16, byteorder="little")
+    def get_positions_by_blobs(self, hash_blobs):
+        """
+        Look up many positions with one IN query per QUERY_CHUNK hashes.
+        Returns a dict from hash blob to position; misses are left out.
+        """
+        unique = list(dict.fromkeys(hash_blobs))
+        positions = {}
+        for start in range(0, len(unique), QUERY_CHUNK):
+            chunk = unique[start : start + QUERY_CHUNK]
+            placeholders = ", ".join("?" * len(chunk))
+            self.cursor.execute(
+                f"SELECT {POSITION_COLUMNS} FROM chessPosition WHERE positionID IN ({placeholders})",
+                chunk,
+            )
+            for result in self.cursor.fetchall():
+                positions[result[0]] = position_row(result)
+        return positions
+
+    def get_next_moves_by_blobs(self, hash_blobs):
+        """
+        Child moves of many positions, one IN query per QUERY_CHUNK hashes.
+        Returns a dict from hash blob to its moves; positions without moves
+        are left out.
+        """
+        unique = list(dict.fromkeys(hash_blobs))
+        moves = {}
+        for start in range(0, len(unique), QUERY_CHUNK):
+            chunk = unique[start : start + QUERY_CHUNK]
+            placeholders = ", ".join("?" * len(chunk))
+            self.cursor.execute(
+                f"""SELECT
+    chessMove.startPosition,
+    {MOVE_COLUMNS}
+    FROM chessMove
+    JOIN chessPosition ON chessMove.endPosition = chessPosition.positionID
+    {UCI_JOIN}
+    WHERE chessMove.startPosition IN ({placeholders})
+""",
+                chunk,
+            )
+            for row in self.cursor.fetchall():
+                moves.setdefault(row[0], []).append(move_row(row[1:]))
+        return moves
+
+    def get_next_moves_by_blob(self, hash_blob):
         self.cursor.execute(
-            """SELECT 
-    chessPosition.timesPlayed AS pos_times_played,
-    chessPosition.positionID,
-    chessPosition.whiteWins,
-    chessPosition.blackWins,
-    chessPosition.recursiveScoreWhite,
-    chessPosition.recursiveScoreBlack,
-    chessMove.timesPlayed AS move_times_played,
-    chessMove.moveSAN,
-    chessMove.elo
+            f"""SELECT
+    {MOVE_COLUMNS}
     FROM chessMove
     JOIN chessPosition ON chessMove.endPosition = chessPosition.positionID
+    {UCI_JOIN}
     WHERE chessMove.startPosition = ?
 """,
             (hash_blob,),
         )
         result = self.cursor.fetchall()
         if result:
-            moves = []
-            for row in result:
-                moves.append(
-                    {
-                        "positionID": row[1],
-                        "timesPlayed": row[0],
-                        "whiteWins": row[2],
-                        "blackWins": row[3],
-                        "recursiveScoreWhite": row[4],
-                        "recursiveScoreBlack": row[5],
-                        "move_times_played": row[6],
-                        "moveSAN": row[7],
-                        "elo": row[8],
-                    }
-                )
-            return moves
+            return [move_row(row) for row in result]
         return None
 
-    def get_position_by_fen(self, fen, rating):
-        position_hash = fen2hash(fen, rating)
-        return self.get_position(position_hash)
+    def select_move_by_blob(self, hash_blob, strategy, white_to_move, point, min_play_rate=0.0):
+        """
+        selection.select_move in SQL: only the chosen move leaves SQLite.
+        avg_player takes the first move in SAN order whose running play
+        count exceeds point * total, the other strategies ORDER BY ... LIMIT 1.
+        """
+        params = [hash_blob, min_play_rate, min_play_rate]
+        if strategy == "avg_player":
+            condition = "cumulative > ? * candidate_total"
+            order = "cumulative"
+            params.append(point)
+        elif strategy in SELECT_ORDER:
+            condition = "pos_times_played > 0" if strategy == "avg_best" else "1"
+            order = SELECT_ORDER[strategy][0 if white_to_move else 1]
+        else:
+            raise ValueError(f"Unknown strategy: {strategy}")
+        self.cursor.execute(
+            f"""WITH moves AS (
+    SELECT
+    {MOVE_COLUMNS},
+    SUM(chessMove.timesPlayed) OVER () AS total
+    FROM chessMove
+    JOIN chessPosition ON chessMove.endPosition = chessPosition.positionID
+    {UCI_JOIN}
+    WHERE chessMove.startPosition = ?
+), candidates AS (
+    SELECT *,
+    SUM(move_times_played) OVER (ORDER BY moveSAN ROWS UNBOUNDED PRECEDING) AS cumulative,
+    SUM(move_times_played) OVER () AS candidate_total
+    FROM moves
+    WHERE ? <= 0 OR (total > 0 AND CAST(move_times_played AS REAL) / total >= ?)
+)
+SELECT pos_times_played, positionID, whiteWins, blackWins, recursiveScoreWhite,
+    recursiveScoreBlack, move_times_played, moveSAN, elo, move_uci
+FROM candidates
+WHERE {condition}
+ORDER BY {order}, moveSAN
+LIMIT 1
+""",
+            params,
+        )
+        row = self.cursor.fetchone()
+        if row:
+            return move_row(row)
+        return None
 
-    def get_next_moves_by_fen(self, fen, rating):
-        position_hash = fen2hash(fen, rating)
-        return self.get_next_moves(position_hash)
+    def get_position_with_moves_by_blob(self, hash_blob, sort=None, limit=None):
+        """
+        Fetch a position and its child moves in one query. Returns
+        (position, moves) where position may be None and moves may be empty.
+        Moves are optionally ordered by a MOVE_SORT_COLUMNS key and truncated.
+        """
+        parent_columns = ", ".join(f"parent.{c}" for c in POSITION_COLUMNS.split(", "))
+        query = f"""SELECT
+    {parent_columns},
+    {MOVE_COLUMNS}
+    FROM (SELECT ? AS id) AS query
+    LEFT JOIN chessPosition AS parent ON parent.positionID = query.id
+    -- Moves into positions the model does not store are skipped here, a
+    -- WHERE on the joined rows would also drop a parent left without moves
+    LEFT JOIN chessMove ON chessMove.startPosition = query.id AND EXISTS (
+        SELECT 1 FROM chessPosition AS child WHERE child.positionID = chessMove.endPosition
+    )
+    LEFT JOIN chessPosition ON chessMove.endPosition = chessPosition.positionID
+    {UCI_JOIN}
+"""
+        params = [hash_blob]
+        if sort is not None:
+            query += f"ORDER BY {MOVE_SORT_COLUMNS[sort]}\n"
+        if limit is not None:
+            # Keep at least one row so limit=0 still returns the position
+            query += "LIMIT ?\n"
+            params.append(max(limit, 1))
+        self.cursor.execute(query, params)
+        rows = self.cursor.fetchall()
+
+        position = None
+        if rows and rows[0][0] is not None:
+            position = position_row(rows[0][:7])
+        moves = [move_row(row[7:]) for row in rows if row[8] is not None]
+        if limit is not None:
+            moves = moves[:limit]
+        return position, moves
+
+    def count_positions(self):
+        self.cursor.execute("SELECT COUNT(*) FROM chessPosition")
+        return self.cursor.fetchone()[0]
+
+    def count_moves(self):
+        self.cursor.execute("SELECT COUNT(*) FROM chessMove")
+        return self.cursor.fetchone()[0]
+
+    def count_move_starts(self):
+        """Number of distinct positions with moves."""
+        self.cursor.execute("SELECT COUNT(DISTINCT startPosition) FROM chessMove")
+        return self.cursor.fetchone()[0]
+
+    def iter_position_ids(self, batch_size=65536):
+        cursor = self.open_connection().cursor()
+        cursor.execute("SELECT positionID FROM chessPosition")
+        while rows := cursor.fetchmany(batch_size):
+            yield [row[0] for row in rows]
+
+    def iter_move_starts(self, batch_size=65536):
+        cursor = self.open_connection().cursor()
+        cursor.execute("SELECT DISTINCT startPosition FROM chessMove")
+        while rows := cursor.fetchmany(batch_size):
+            yield [row[0] for row in rows]
+
+    def iter_position_rows(self, batch_size=65536):
+        cursor = self.open_connection().cursor()
+        cursor.execute(f"SELECT {POSITION_COLUMNS} FROM chessPosition")
+        while rows := cursor.fetchmany(batch_size):
+            yield rows
+
+    def iter_move_rows(self, batch_size=65536):
+        """Yield (startPosition, endPosition, moveSAN, timesPlayed, elo, uci) rows."""
+        cursor = self.open_connection().cursor()
+        cursor.execute(
+            f"""SELECT chessMove.startPosition, chessMove.endPosition, chessMove.moveSAN,
+    chessMove.timesPlayed, chessMove.elo, moveUCI.uci
+    FROM chessMove
+    {UCI_JOIN}"""
+        )
+        while rows := cursor.fetchmany(batch_size):
+            yield rows
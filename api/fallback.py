@@ -0,0 +1,111 @@
+from chess_hash import RATING_ARRAY
+
+# nearest: closest band that knows the position
+# widen:   all bands at the smallest distance that knows the position, merged
+# merge:   all bands within the window, merged
+FALLBACK_POLICIES = ("nearest", "widen", "merge")
+
+
+def candidate_bands(rating, window=None):
+    """Bands within `window` of `rating`, nearest first (lower band on ties)."""
+    if window is None:
+        window = len(RATING_ARRAY)
+    low = max(rating - window, 0)
+    high = min(rating + window + 1, len(RATING_ARRAY))
+    return sorted(range(low, high), key=lambda band: (abs(band - rating), band))
+
+
+def choose_bands(rating, found, policy):
+    """Pick the answering bands from those in `found` (ordered nearest first)."""
+    if not found:
+        return []
+    if policy == "nearest":
+        return found[:1]
+    if policy == "widen":
+        distance = abs(found[0] - rating)
+        return [band for band in found if abs(band - rating) == distance]
+    if policy == "merge":
+        return found
+    raise ValueError(f"Unknown fallback policy: {policy}")
+
+
+def rebase_blob(hash_blob, band, rating):
+    """Move a hash from one rating band to another by swapping rating keys."""
+    value = int.from_bytes(hash_blob, "little") ^ RATING_ARRAY[band] ^ RATING_ARRAY[rating]
+    return value.to_bytes(16, "little")
+
+
+def weighted(entries, key, weight):
+    total = sum(entry[weight] for entry in entries)
+    if not total:
+        return entries[0][key]
+    return sum(entry[key] * entry[weight] for entry in entries) / total
+
+
+def merge_positions(positions, bands, rating):
+    """Sum counts and average recursive scores weighted by timesPlayed."""
+    return {
+        "positionID": rebase_blob(positions[0]["positionID"], bands[0], rating),
+        "timesPlayed": sum(p["timesPlayed"] for p in positions),
+        "whiteWins": sum(p["whiteWins"] for p in positions),
+        "blackWins": sum(p["blackWins"] for p in positions),
+        "recursiveScoreWhite": weighted(positions, "recursiveScoreWhite", "timesPlayed"),
+        "recursiveScoreBlack": weighted(positions, "recursiveScoreBlack", "timesPlayed"),
+        "elo": rating,
+    }
+
+
+def merge_moves(band_moves, rating):
+    """Merge the move lists of several bands by SAN, like merge_positions."""
+    by_san = {}
+    for band, moves in band_moves:
+        for move in moves:
+            by_san.setdefault(move["moveSAN"], []).append((band, move))
+    merged = []
+    for san, entries in by_san.items():
+        moves = [move for _, move in entries]
+        merged.append(
+            {
+                "positionID": rebase_blob(moves[0]["positionID"], entries[0][0], rating),
+                "timesPlayed": sum(m["timesPlayed"] for m in moves),
+                "whiteWins": sum(m["whiteWins"] for m in moves),
+                "blackWins": sum(m["blackWins"] for m in moves),
+                "recursiveScoreWhite": weighted(moves, "recursiveScoreWhite", "timesPlayed"),
+                "recursiveScoreBlack": weighted(moves, "recursiveScoreBlack", "timesPlayed"),
+                "move_times_played": sum(m["move_times_played"] for m in moves),
+                "moveSAN": san,
+                "elo": rating,
+                "moveUCI": next((m["moveUCI"] for m in moves if m["moveUCI"]), None),
+                "bands": [band for band, _ in entries],
+            }
+        )
+    return merged
+
+
+def position_with_fallback(database, fen, rating, policy, window=None):
+    """
+    Resolve a position under a fallback policy with one batched lookup over
+    the candidate bands. Returns (position or None, answering bands). A
+    single answering band is returned as stored; several are merged and
+    their positionID is rebased to `rating`.
+    """
+    bands = database.get_bands_by_fen(fen, candidate_bands(rating, window))
+    found = [band for band, (position, _) in bands.items() if position is not None]
+    chosen = choose_bands(rating, found, policy)
+    if not chosen:
+        return None, []
+    if len(chosen) == 1:
+        return bands[chosen[0]][0], chosen
+    return merge_positions([bands[band][0] for band in chosen], chosen, rating), chosen
+
+
+def next_moves_with_fallback(database, fen, rating, policy, window=None):
+    """Child moves under a fallback policy, see position_with_fallback."""
+    bands = database.get_bands_by_fen(fen, candidate_bands(rating, window), children=True)
+    found = [band for band, (_, moves) in bands.items() if moves]
+    chosen = choose_bands(rating, found, policy)
+    if not chosen:
+        return None, []
+    if len(chosen) == 1:
+        return [dict(move, bands=chosen) for move in bands[chosen[0]][1]], chosen
+    return merge_moves([(band, bands[band][1]) for band in chosen], rating), chosen
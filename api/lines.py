@@ -0,0 +1,54 @@
+import chess
+
+from chess_hash import fen2hash, move_hash
+
+
+def parse_move(board, move):
+    """Parse a UCI or SAN move, raising ValueError if it is illegal."""
+    try:
+        parsed = chess.Move.from_uci(move)
+        if parsed in board.legal_moves:
+            return parsed
+    except ValueError:
+        pass
+    parsed = board.parse_san(move)
+    # parse_san accepts null moves ("0000", "--"), which no line can play
+    if not parsed:
+        raise ValueError(f"null move: {move}")
+    return parsed
+
+
+def replay_line(fen, rating, moves):
+    """
+    Replay `moves` (UCI or SAN) from `fen`, hashing each ply incrementally.
+    Returns one (ply, uci, san, fen, hash_blob) tuple per position, starting
+    with the start position at ply 0 (uci and san None).
+    """
+    board = chess.Board(fen)
+    position_hash = fen2hash(fen, rating)
+    plies = [(0, None, None, board.fen(), position_hash.to_bytes(16, "little"))]
+    for ply, move in enumerate(moves, start=1):
+        try:
+            parsed = parse_move(board, move)
+        except ValueError:
+            raise ValueError(f"Illegal move at ply {ply}: {move}")
+        san = board.san(parsed)
+        position_hash = move_hash(position_hash, board, parsed)
+        board.push(parsed)
+        plies.append((ply, parsed.uci(), san, board.fen(), position_hash.to_bytes(16, "little")))
+    return plies
+
+
+def get_line(database, fen, rating, moves, children=False):
+    """
+    Stats for every position of a line, fetched with one batched lookup for
+    positions and, if `children` is set, one for their child moves.
+    """
+    plies = replay_line(fen, rating, moves)
+    hash_blobs = [ply[4] for ply in plies]
+    positions = database.get_positions_by_blobs(hash_blobs)
+    next_moves = database.get_next_moves_by_blobs(hash_blobs) if children else {}
+    return [
+        (ply, uci, san, ply_fen, positions.get(hash_blob), next_moves.get(hash_blob, []))
+        for ply, uci, san, ply_fen, hash_blob in plies
+    ]
@@ -1,11 +1,70 @@
 # KI-Generiert
-from db import Database
-from fastapi import FastAPI
+from array_db import ArrayDatabase
+from bloom import BloomFilteredDatabase
+from cache import CachedDatabase
+from chess_hash import RATING_ARRAY, fen2blob
+from concurrent.futures import ThreadPoolExecutor
+from db import MOVE_SORT_COLUMNS, Database
+from fastapi import FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fallback import FALLBACK_POLICIES, next_moves_with_fallback, position_with_fallback
+from fastapi.responses import StreamingResponse
+from lines import get_line
+from model_file import MappedDatabase
+from pydantic import BaseModel
+from selection import STRATEGIES, sample_point
+from selfplay import SERIES, play_games
+from tree import DEFAULT_MAX_NODES, walk_tree
+from uci import with_uci
+from typing import List, Literal, Optional
+import asyncio
 import base64
+import chess
+import itertools
+import json
+import os
 
-# Initialize database
-db = Database("../models/results.sqlite")
+MAX_BATCH_POSITIONS = 1000
+MAX_LINE_MOVES = 500
+MAX_TREE_DEPTH = 20
+MAX_SELFPLAY_GAMES = 1000
+TREE_STREAM_BATCH = 500
+
+# Configuration via environment, e.g. DB_WORKERS=8 ./start.sh
+DB_FILE = os.environ.get("DB_FILE", "../models/results.sqlite")
+# "sqlite" queries the model file, "arrays" loads it into NumPy arrays,
+# "mmap" serves a model file written by convert_model.py
+DB_BACKEND = os.environ.get("DB_BACKEND", "sqlite")
+DB_WORKERS = int(os.environ.get("DB_WORKERS", os.cpu_count() or 4))
+DB_QUEUE_DEPTH = int(os.environ.get("DB_QUEUE_DEPTH", 256))
+DB_IMMUTABLE = os.environ.get("DB_IMMUTABLE", "1") == "1"
+CACHE_ENTRIES = int(os.environ.get("CACHE_ENTRIES", 100000))
+CACHE_MB = int(os.environ.get("CACHE_MB", 256))
+BLOOM_MB = int(os.environ.get("BLOOM_MB", 64))
+BLOOM_FP_RATE = float(os.environ.get("BLOOM_FP_RATE", 0.01))
+BLOOM_FILE = os.environ.get("BLOOM_FILE")
+# Edges one tree request may list, which bounds its memory
+MAX_TREE_NODES = int(os.environ.get("MAX_TREE_NODES", DEFAULT_MAX_NODES))
+
+# Initialize database: bloom filter -> cache -> backend
+if DB_BACKEND == "arrays":
+    db = ArrayDatabase(DB_FILE)
+elif DB_BACKEND == "mmap":
+    db = MappedDatabase(DB_FILE)
+elif DB_BACKEND == "sqlite":
+    db = Database(DB_FILE, immutable=DB_IMMUTABLE)
+else:
+    raise ValueError(f"Unknown DB_BACKEND: {DB_BACKEND}")
+cached_db = None
+bloom_db = None
+if CACHE_ENTRIES > 0 and CACHE_MB > 0:
+    db = cached_db = CachedDatabase(db, CACHE_ENTRIES, CACHE_MB * 1024 * 1024)
+if BLOOM_MB > 0:
+    db = bloom_db = BloomFilteredDatabase.from_model(
+        db, DB_FILE, BLOOM_FP_RATE, BLOOM_MB * 1024 * 1024, BLOOM_FILE
+    )
+db_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="db")
+db_pending = 0
 
 app = FastAPI()
 
@@ -19,86 +78,394 @@ app.add_middleware(
 )
 
 
+MoveSort = Literal[tuple(MOVE_SORT_COLUMNS)]
+FallbackPolicy = Literal[FALLBACK_POLICIES]
+Strategy = Literal[STRATEGIES]
+Series = Literal[SERIES]
+
+
+class PositionQuery(BaseModel):
+    hash: Optional[int] = None
+    fen: Optional[str] = None
+    rating: Optional[int] = None
+
+
+class PositionsRequest(BaseModel):
+    positions: List[PositionQuery]
+
+
+class SelfPlayRequest(BaseModel):
+    evaluated: Strategy
+    baseline: Strategy
+    evaluated_rating: int
+    baseline_rating: int
+    # Plain FENs, one game each; empty plays `games` from the start position
+    openings: List[str] = []
+    games: int = 1
+    series: Series = "avg"
+    generate_openings: bool = False
+    max_moves: Optional[int] = None
+    seed: Optional[int] = None
+    first_game: int = 0
+
+
+def position_response(position):
+    return {
+        "positionID": str(int.from_bytes(position["positionID"], byteorder="little")),
+        "timesPlayed": position["timesPlayed"],
+        "whiteWins": position["whiteWins"],
+        "blackWins": position["blackWins"],
+        "recursiveScoreWhite": position["recursiveScoreWhite"],
+        "recursiveScoreBlack": position["recursiveScoreBlack"],
+        "elo": position["elo"],
+    }
+
+
+def move_response(move):
+    return {
+        "positionID": str(int.from_bytes(move["positionID"], byteorder="little")),
+        "timesPlayed": move["timesPlayed"],
+        "whiteWins": move["whiteWins"],
+        "blackWins": move["blackWins"],
+        "recursiveScoreWhite": move["recursiveScoreWhite"],
+        "recursiveScoreBlack": move["recursiveScoreBlack"],
+        "move_times_played": move["move_times_played"],
+        "moveSAN": move["moveSAN"],
+        "moveUCI": move["moveUCI"],
+    }
+
+
+def node_response(position, moves):
+    return {
+        "position": position_response(position) if position else None,
+        "moves": [move_response(move) for move in moves],
+    }
+
+
+def query_blob(query):
+    if query.hash is not None:
+        return query.hash.to_bytes(16, byteorder="little")
+    if query.fen is not None and query.rating is not None:
+        return fen2blob(query.fen, query.rating)
+    raise ValueError("Either hash or fen and rating are required")
+
+
+async def run_db(fn, *args):
+    """
+    Run a blocking database call on the db thread pool. Requests beyond
+    DB_QUEUE_DEPTH queued or running calls are rejected with 503.
+    """
+    global db_pending
+    if db_pending >= DB_QUEUE_DEPTH:
+        raise HTTPException(status_code=503, detail="Database queue full")
+    db_pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(db_executor, fn, *args)
+    finally:
+        db_pending -= 1
+
+
+@app.on_event("shutdown")
+def shutdown():
+    db_executor.shutdown(wait=True)
+    db.close()
+
+
 @app.get("/")
 async def root():
     return {"message": "Hello World"}
 
 
+@app.get("/admin/cache")
+async def get_cache_stats():
+    if cached_db is None:
+        return {"error": "Cache disabled"}
+    return cached_db.cache.stats()
+
+
+@app.delete("/admin/cache")
+async def clear_cache():
+    if cached_db is None:
+        return {"error": "Cache disabled"}
+    cached_db.cache.clear()
+    return cached_db.cache.stats()
+
+
+@app.get("/admin/bloom")
+async def get_bloom_stats():
+    if bloom_db is None:
+        return {"error": "Bloom filter disabled"}
+    return bloom_db.stats()
+
+
 @app.get("/position/{position_hash}")
 async def get_position(position_hash: int):
-    position = db.get_position(position_hash)
+    position = await run_db(db.get_position, position_hash)
     if position:
-        return {
-            "positionID": str(int.from_bytes(position["positionID"], "little")),
-            "timesPlayed": position["timesPlayed"],
-            "whiteWins": position["whiteWins"],
-            "blackWins": position["blackWins"],
-            "recursiveScoreWhite": position["recursiveScoreWhite"],
-            "recursiveScoreBlack": position["recursiveScoreBlack"],
-            "elo": position["elo"],
-        }
+        return position_response(position)
     return {"error": "Position not found"}
 
 
 @app.get("/position/{position_hash}/moves")
 async def get_next_moves(position_hash: int):
-    moves = db.get_next_moves(position_hash)
+    moves = await run_db(db.get_next_moves, position_hash)
     if moves:
-        return [
-            {
-                "positionID": str(
-                    int.from_bytes(move["positionID"], byteorder="little")
-                ),
-                "timesPlayed": move["timesPlayed"],
-                "whiteWins": move["whiteWins"],
-                "blackWins": move["blackWins"],
-                "recursiveScoreWhite": move["recursiveScoreWhite"],
-                "recursiveScoreBlack": move["recursiveScoreBlack"],
-                "move_times_played": move["move_times_played"],
-                "moveSAN": move["moveSAN"],
-            }
-            for move in moves
-        ]
+        return [move_response(move) for move in moves]
     return {"error": "No moves found for this position"}
 
 
 @app.get("/fen/{fen}/{rating}/position")
-async def get_position_by_fen(fen: str, rating: int):
+async def get_position_by_fen(
+    fen: str,
+    rating: int,
+    fallback: Optional[FallbackPolicy] = None,
+    window: Optional[int] = Query(None, ge=0),
+):
+    """
+    With a `fallback` policy (see fallback.py), bands within `window` of
+    `rating` are tried in one lookup and the response lists the answering
+    `bands`.
+    """
     fen_dec = base64.b64decode(fen).decode("utf-8")
-    position = db.get_position_by_fen(fen_dec, rating)
+    if fallback is None:
+        position = await run_db(db.get_position_by_fen, fen_dec, rating)
+    else:
+        position, bands = await run_db(
+            position_with_fallback, db, fen_dec, rating, fallback, window
+        )
     if position:
-        return {
-            "positionID": str(
-                int.from_bytes(position["positionID"], byteorder="little")
-            ),
-            "timesPlayed": position["timesPlayed"],
-            "whiteWins": position["whiteWins"],
-            "blackWins": position["blackWins"],
-            "recursiveScoreWhite": position["recursiveScoreWhite"],
-            "recursiveScoreBlack": position["recursiveScoreBlack"],
-            "elo": position["elo"],
-        }
+        response = position_response(position)
+        if fallback is not None:
+            response["bands"] = bands
+        return response
     return {"error": "Position not found"}
 
 
 @app.get("/fen/{fen}/{rating}/moves")
-async def get_next_moves_by_fen(fen: str, rating: int):
+async def get_next_moves_by_fen(
+    fen: str,
+    rating: int,
+    fallback: Optional[FallbackPolicy] = None,
+    window: Optional[int] = Query(None, ge=0),
+):
+    """With a `fallback` policy each move lists the `bands` it came from."""
     fen_dec = base64.b64decode(fen).decode("utf-8")
-    moves = db.get_next_moves_by_fen(fen_dec, rating)
+    if fallback is None:
+        moves = await run_db(db.get_next_moves_by_fen, fen_dec, rating)
+    else:
+        moves, _ = await run_db(
+            next_moves_with_fallback, db, fen_dec, rating, fallback, window
+        )
     if moves:
-        return [
-            {
-                "positionID": str(
-                    int.from_bytes(move["positionID"], byteorder="little")
-                ),
-                "timesPlayed": move["timesPlayed"],
-                "whiteWins": move["whiteWins"],
-                "blackWins": move["blackWins"],
-                "recursiveScoreWhite": move["recursiveScoreWhite"],
-                "recursiveScoreBlack": move["recursiveScoreBlack"],
-                "move_times_played": move["move_times_played"],
-                "moveSAN": move["moveSAN"],
-            }
-            for move in moves
-        ]
+        moves = with_uci(fen_dec, moves)
+        responses = [move_response(move) for move in moves]
+        if fallback is not None:
+            for response, move in zip(responses, moves):
+                response["bands"] = move["bands"]
+        return responses
     return {"error": "No moves found for this position"}
+
+
+@app.get("/position/{position_hash}/node")
+async def get_node(
+    position_hash: int,
+    sort: Optional[MoveSort] = None,
+    limit: Optional[int] = Query(None, ge=0),
+):
+    position, moves = await run_db(db.get_position_with_moves, position_hash, sort, limit)
+    return node_response(position, moves)
+
+
+@app.get("/fen/{fen}/{rating}/node")
+async def get_node_by_fen(
+    fen: str,
+    rating: int,
+    sort: Optional[MoveSort] = None,
+    limit: Optional[int] = Query(None, ge=0),
+):
+    """
+    Position stats and child moves in one response: {"position", "moves"}.
+    `position` is null for unknown positions, `moves` may be empty.
+    """
+    fen_dec = base64.b64decode(fen).decode("utf-8")
+    position, moves = await run_db(
+        db.get_position_with_moves_by_fen, fen_dec, rating, sort, limit
+    )
+    return node_response(position, with_uci(fen_dec, moves))
+
+
+@app.get("/fen/{fen}/{rating}/line")
+async def get_line_by_fen(fen: str, rating: int, moves: str = "", children: bool = False):
+    """
+    Replay a comma-separated list of UCI or SAN moves from a position and
+    return the stats of every ply (ply 0 is the start position), with the
+    child moves of each ply if `children` is set.
+    """
+    fen_dec = base64.b64decode(fen).decode("utf-8")
+    move_list = [move for move in moves.split(",") if move]
+    if len(move_list) > MAX_LINE_MOVES:
+        return {"error": f"At most {MAX_LINE_MOVES} moves per line"}
+    try:
+        plies = await run_db(get_line, db, fen_dec, rating, move_list, children)
+    except ValueError as e:
+        return {"error": str(e)}
+    results = []
+    for ply, uci, san, ply_fen, position, next_moves in plies:
+        result = {
+            "ply": ply,
+            "move": uci,
+            "moveSAN": san,
+            "fen": ply_fen,
+            "position": position_response(position) if position else None,
+        }
+        if children:
+            result["moves"] = [move_response(move) for move in with_uci(ply_fen, next_moves)]
+        results.append(result)
+    return results
+
+
+@app.get("/fen/{fen}/{rating}/select")
+async def select_move_by_fen(
+    fen: str,
+    rating: int,
+    strategy: Strategy,
+    seed: Optional[int] = None,
+    min_play_rate: float = Query(0.0, ge=0, le=1),
+):
+    """
+    Pick a single move with one of the engines.py strategies (avg_player
+    samples by play count, reproducibly with `seed`). Moves with a smaller
+    share of all plays than `min_play_rate` are ignored. Returns the move
+    in UCI as `move` (same as `moveUCI`) next to the usual move fields.
+    """
+    fen_dec = base64.b64decode(fen).decode("utf-8")
+    move = await run_db(
+        db.select_move_by_fen, fen_dec, rating, strategy, sample_point(seed), min_play_rate
+    )
+    if move is None:
+        return {"error": "No moves found for this position"}
+    response = move_response(with_uci(fen_dec, [move])[0])
+    response["move"] = response["moveUCI"]
+    return response
+
+
+@app.get("/fen/{fen}/bands")
+async def get_bands_by_fen(fen: str, ratings: str = "", children: bool = False):
+    """
+    A position in every rating band, or in the comma-separated `ratings`.
+    Returns {rating: {"position", "moves"}} with null/empty entries for
+    bands that do not know the position; moves only if `children` is set.
+    """
+    fen_dec = base64.b64decode(fen).decode("utf-8")
+    try:
+        band_list = [int(rating) for rating in ratings.split(",") if rating] or None
+    except ValueError:
+        return {"error": "ratings must be a comma-separated list of integers"}
+    if band_list is not None and not all(0 <= r < len(RATING_ARRAY) for r in band_list):
+        return {"error": f"ratings must be between 0 and {len(RATING_ARRAY) - 1}"}
+    bands = await run_db(db.get_bands_by_fen, fen_dec, band_list, children)
+    results = {}
+    for rating, (position, moves) in bands.items():
+        results[rating] = node_response(position, with_uci(fen_dec, moves))
+        if not children:
+            del results[rating]["moves"]
+    return results
+
+
+@app.get("/fen/{fen}/{rating}/tree")
+async def get_tree_by_fen(
+    fen: str,
+    rating: int,
+    depth: int = Query(3, ge=0, le=MAX_TREE_DEPTH),
+    min_played: int = Query(0, ge=0),
+    max_nodes: int = Query(MAX_TREE_NODES, ge=0, le=MAX_TREE_NODES),
+):
+    """
+    Stream the opening tree below a position as NDJSON, breadth first. The
+    first line is the root position (if known), every further line a move
+    with its depth, parentID and whether it transposes into a position that
+    was already listed (those are not expanded again). At most `max_nodes`
+    moves are listed, MAX_TREE_NODES by default.
+    """
+    fen_dec = base64.b64decode(fen).decode("utf-8")
+    nodes = walk_tree(db, fen2blob(fen_dec, rating), depth, min_played, max_nodes)
+
+    async def lines():
+        while batch := await run_db(list, itertools.islice(nodes, TREE_STREAM_BATCH)):
+            for level, parent_blob, node, transposition in batch:
+                if parent_blob is None:
+                    line = position_response(node)
+                else:
+                    line = move_response(node)
+                    line["parentID"] = str(int.from_bytes(parent_blob, byteorder="little"))
+                    line["transposition"] = transposition
+                line["depth"] = level
+                yield json.dumps(line) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@app.post("/positions")
+async def get_positions(request: PositionsRequest):
+    """
+    Look up many positions by hash or by (plain, not base64) FEN and rating.
+    Results are returned in request order; misses and invalid queries get an
+    error entry in their slot.
+    """
+    if len(request.positions) > MAX_BATCH_POSITIONS:
+        return {"error": f"At most {MAX_BATCH_POSITIONS} positions per request"}
+
+    blobs = []
+    for query in request.positions:
+        try:
+            blobs.append(query_blob(query))
+        except (ValueError, IndexError, OverflowError) as e:
+            blobs.append(e)
+
+    found = await run_db(
+        db.get_positions_by_blobs, [b for b in blobs if isinstance(b, bytes)]
+    )
+    results = []
+    for blob in blobs:
+        if not isinstance(blob, bytes):
+            results.append({"error": str(blob)})
+        elif blob in found:
+            results.append(position_response(found[blob]))
+        else:
+            results.append({"error": "Position not found"})
+    return results
+
+
+@app.post("/selfplay")
+async def selfplay(request: SelfPlayRequest):
+    """
+    Play games between two strategies entirely on the server, like
+    apps/model-eval with database engines: the evaluated side takes white
+    in even games, counting from `first_game`, and `series` is "avg"
+    (eval_pos_avg before each move) or "frequency" (play rate of the
+    evaluated side's moves). Returns one series per game in opening order;
+    with a `seed` runs are reproducible.
+    """
+    openings = request.openings or [chess.STARTING_FEN] * request.games
+    if not 0 < len(openings) <= MAX_SELFPLAY_GAMES:
+        return {"error": f"Between 1 and {MAX_SELFPLAY_GAMES} games per request"}
+    ratings = (request.evaluated_rating, request.baseline_rating)
+    if not all(0 <= r < len(RATING_ARRAY) for r in ratings):
+        return {"error": f"ratings must be between 0 and {len(RATING_ARRAY) - 1}"}
+    try:
+        return await run_db(
+            play_games,
+            db,
+            request.evaluated,
+            request.baseline,
+            request.evaluated_rating,
+            request.baseline_rating,
+            openings,
+            request.series,
+            request.generate_openings,
+            request.max_moves,
+            request.seed,
+            request.first_game,
+        )
+    except ValueError as e:
+        return {"error": str(e)}
@@ -0,0 +1,114 @@
+import mmap
+import struct
+
+import numpy as np
+
+from array_db import ArrayDatabase
+
+MAGIC = b"CSSMODEL"
+VERSION = 1
+# magic, version, section count
+HEADER = struct.Struct("<8sII")
+# name, dtype, element count, byte offset
+SECTION = struct.Struct("<32s8sQQ")
+ALIGNMENT = 64
+
+# ArrayDatabase attributes stored as sections, in file order
+ARRAY_SECTIONS = [
+    "key_hi",
+    "key_lo",
+    "times_played",
+    "white_wins",
+    "black_wins",
+    "recursive_white",
+    "recursive_black",
+    "elo",
+    "move_offsets",
+    "move_child",
+    "move_san",
+    "move_times_played",
+    "move_elo",
+    "move_uci",
+    "start_hi",
+    "start_lo",
+]
+
+
+def san_sections(san_pool):
+    encoded = [san.encode("utf-8") for san in san_pool]
+    offsets = np.zeros(len(encoded) + 1, dtype="<u4")
+    offsets[1:] = np.cumsum([len(san) for san in encoded])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def band_sections(elo):
+    bands, counts = np.unique(elo, return_counts=True)
+    return bands.astype("<u4"), counts.astype("<u8")
+
+
+def write_model(database, file):
+    """
+    Write an ArrayDatabase as a memory-mappable model: a header, a table of
+    sections (name, dtype, count, offset) and one 64-byte aligned, fixed-width
+    little-endian array per section. Positions are stored column by column in
+    hash order so the key columns can be binary searched in place.
+    """
+    sections = {name: getattr(database, name) for name in ARRAY_SECTIONS}
+    sections["san_bytes"], sections["san_offsets"] = san_sections(database.san_pool)
+    sections["band_elo"], sections["band_positions"] = band_sections(database.elo)
+
+    offset = HEADER.size + SECTION.size * len(sections)
+    table = []
+    for name, array in sections.items():
+        array = np.ascontiguousarray(array, dtype=array.dtype.newbyteorder("<"))
+        offset = -(-offset // ALIGNMENT) * ALIGNMENT
+        table.append((name, array, offset))
+        offset += array.nbytes
+
+    with open(file, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(table)))
+        for name, array, offset in table:
+            f.write(SECTION.pack(name.encode(), array.dtype.str.encode(), len(array), offset))
+        for name, array, offset in table:
+            f.write(b"\0" * (offset - f.tell()))
+            f.write(array.tobytes())
+
+
+class MappedDatabase(ArrayDatabase):
+    """
+    ArrayDatabase served straight from a model file written by write_model.
+    The arrays are read-only views into a shared mmap, so every worker
+    process serving the same file shares one copy through the page cache.
+    """
+
+    def __init__(self, file):
+        with open(file, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{file} is not a model file")
+        if version != VERSION:
+            raise ValueError(f"Unsupported model file version {version} in {file}")
+
+        sections = {}
+        for i in range(count):
+            name, dtype, length, offset = SECTION.unpack_from(self.map, HEADER.size + i * SECTION.size)
+            sections[name.rstrip(b"\0").decode()] = np.frombuffer(
+                self.map, dtype=np.dtype(dtype.rstrip(b"\0").decode()), count=length, offset=offset
+            )
+        # Model files written before move_uci existed know no UCI for any edge
+        sections.setdefault("move_uci", np.zeros(len(sections["move_child"]), dtype=np.uint8))
+        # Older files have no moves from unstored start positions
+        sections.setdefault("start_hi", np.array([], dtype=np.uint64))
+        sections.setdefault("start_lo", np.array([], dtype=np.uint64))
+        for name in ARRAY_SECTIONS:
+            setattr(self, name, sections[name])
+
+        san_bytes = sections["san_bytes"].tobytes()
+        san_offsets = sections["san_offsets"]
+        self.san_pool = np.array(
+            [san_bytes[start:end].decode("utf-8") for start, end in zip(san_offsets[:-1], san_offsets[1:])],
+            dtype=object,
+        )
+        self.bands = dict(zip(sections["band_elo"].tolist(), sections["band_positions"].tolist()))
+        print(f"Mapped {len(self.key_hi)} positions and {len(self.move_child)} moves from {file}")
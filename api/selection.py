@@ -0,0 +1,62 @@
+import random
+
+# Move selection strategies of apps/model-eval/engines.py, by ENGINE_FUNCTIONS name
+STRATEGIES = (
+    "avg_player",
+    "avg_best",
+    "avg_player_deterministic",
+    "recursive_best",
+    "recursive_worst",
+)
+
+
+def sample_point(seed=None):
+    """Point in [0, 1) for avg_player; seeded calls always pick the same move."""
+    if seed is None:
+        return random.random()
+    return random.Random(seed).random()
+
+
+def white_win_rate(move):
+    return move["whiteWins"] / move["timesPlayed"]
+
+
+def select_move(moves, strategy, white_to_move, point, min_play_rate=0.0):
+    """
+    Pick a move the way the matching engine does. avg_player samples moves
+    weighted by move_times_played in SAN order, taking the first move whose
+    cumulative count exceeds point * total. Moves whose share of all plays
+    is below min_play_rate are ignored. Ties go to the first move in SAN
+    order. Returns None if nothing is left.
+    """
+    total = sum(move["move_times_played"] for move in moves)
+    if min_play_rate > 0:
+        moves = [m for m in moves if total and m["move_times_played"] / total >= min_play_rate]
+    if not moves:
+        return None
+    moves = sorted(moves, key=lambda move: move["moveSAN"])
+
+    if strategy == "avg_player":
+        threshold = point * sum(move["move_times_played"] for move in moves)
+        cumulative = 0
+        for move in moves:
+            cumulative += move["move_times_played"]
+            if cumulative > threshold:
+                return move
+        return None
+    if strategy == "avg_player_deterministic":
+        return max(moves, key=lambda move: move["move_times_played"])
+    if strategy == "avg_best":
+        played = [move for move in moves if move["timesPlayed"] > 0]
+        if not played:
+            return None
+        if white_to_move:
+            return max(played, key=white_win_rate)
+        return min(played, key=white_win_rate)
+    if strategy == "recursive_best":
+        key = "recursiveScoreWhite" if white_to_move else "recursiveScoreBlack"
+        return max(moves, key=lambda move: move[key])
+    if strategy == "recursive_worst":
+        key = "recursiveScoreBlack" if white_to_move else "recursiveScoreWhite"
+        return max(moves, key=lambda move: move[key])
+    raise ValueError(f"Unknown strategy: {strategy}")
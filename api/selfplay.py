@@ -0,0 +1,157 @@
+import random
+
+import chess
+
+from chess_hash import board_hash, hash_add_rating, move_hash
+from selection import select_move
+
+# Series recorded per game, see apps/model-eval/main.py play_game
+SERIES = ("avg", "frequency")
+OPENING_PLIES = 4
+
+
+class Game:
+    """A board with its unrated hash, kept up to date move by move."""
+
+    def __init__(self, fen):
+        self.board = chess.Board(fen)
+        self.hash = board_hash(self.board)
+
+    def node(self, database, rating):
+        blob = hash_add_rating(self.hash, rating).to_bytes(16, byteorder="little")
+        return database.get_position_with_moves_by_blob(blob)
+
+    def parse(self, move):
+        if move.get("moveUCI"):
+            return chess.Move.from_uci(move["moveUCI"])
+        return self.board.parse_san(move["moveSAN"])
+
+    def push(self, move):
+        self.hash = move_hash(self.hash, self.board, move)
+        self.board.push(move)
+
+
+def choose(game, moves, strategy, rng):
+    """A legal move picked like the engines.py strategy, or None."""
+    point = rng.random() if strategy == "avg_player" else 0.0
+    chosen = select_move(moves, strategy, game.board.turn == chess.WHITE, point)
+    if chosen is None:
+        return None, None
+    try:
+        move = game.parse(chosen)
+    except ValueError:
+        return None, None
+    if move not in game.board.legal_moves:
+        return None, None
+    return move, chosen
+
+
+def opening_fen(database, rating, rng, fen=chess.STARTING_FEN):
+    """Play OPENING_PLIES avg_player moves, like generate_opening_fen."""
+    game = Game(fen)
+    for _ in range(OPENING_PLIES):
+        if game.board.is_game_over(claim_draw=True):
+            break
+        _, moves = game.node(database, rating)
+        move, _ = choose(game, moves, "avg_player", rng)
+        if move is None:
+            break
+        game.push(move)
+    return game.board.fen()
+
+
+def play_game(
+    database,
+    evaluated,
+    baseline,
+    evaluated_rating,
+    baseline_rating,
+    fen,
+    evaluated_color,
+    series="avg",
+    max_moves=None,
+    rng=random,
+):
+    """
+    model-eval's play_game between two selection.STRATEGIES, straight on
+    the model. Returns the evaluated side's series: eval_pos_avg before
+    every move ("avg") or the play rate of each of its moves ("frequency").
+    """
+    game = Game(fen)
+    values = []
+    move_count = 0
+    while not game.board.is_game_over(claim_draw=True):
+        if max_moves is not None and move_count >= max_moves:
+            break
+        evaluated_turn = game.board.turn == evaluated_color
+        position = None
+        if series == "avg" or evaluated_turn:
+            position, moves = game.node(database, evaluated_rating)
+        if series == "avg" and position and position["timesPlayed"] > 0:
+            value = position["whiteWins"] / position["timesPlayed"] - 0.5
+            values.append(-value if evaluated_color == chess.BLACK else value)
+
+        if evaluated_turn:
+            move, chosen = choose(game, moves, evaluated, rng)
+        else:
+            _, moves = game.node(database, baseline_rating)
+            move, chosen = choose(game, moves, baseline, rng)
+        if move is None:
+            break
+
+        if series == "frequency" and evaluated_turn:
+            total = position["timesPlayed"] if position else 0
+            if total <= 0:
+                total = sum(m["move_times_played"] for m in moves)
+            if total > 0:
+                values.append(chosen["move_times_played"] / total)
+
+        game.push(move)
+        move_count += 1
+    return values
+
+
+def play_games(
+    database,
+    evaluated,
+    baseline,
+    evaluated_rating,
+    baseline_rating,
+    openings,
+    series="avg",
+    generate_openings=False,
+    max_moves=None,
+    seed=None,
+    first_game=0,
+):
+    """
+    Play one game per opening FEN, the evaluated side taking white in even
+    games counting from `first_game`, which lets a resumed run keep the
+    colours of its remaining games. With generate_openings every game
+    starts from OPENING_PLIES avg_player moves at the baseline rating
+    instead. All randomness comes from `seed`. Returns one series per game,
+    the rows of model-eval's CSV.
+    """
+    if series not in SERIES:
+        raise ValueError(f"Unknown series: {series}")
+    rng = random.Random(seed)
+    results = []
+    for i, fen in enumerate(openings):
+        if generate_openings:
+            fen = opening_fen(database, baseline_rating, rng)
+        evaluated_color = chess.WHITE if (first_game + i) % 2 == 0 else chess.BLACK
+        results.append(
+            play_game(
+                database,
+                evaluated,
+                baseline,
+                evaluated_rating,
+                baseline_rating,
+                fen,
+                evaluated_color,
+                series,
+                max_moves,
+                rng,
+            )
+        )
+    return results
@@ -0,0 +1,279 @@
+"""
+Parity of the model backends: ArrayDatabase, MappedDatabase and the cache
+and bloom filter wrappers must answer every lookup the API makes exactly
+like the SQLite Database.
+
+    python -m pytest api/test_backends.py
+"""
+import random
+import sqlite3
+
+import chess
+import pytest
+
+from array_db import ArrayDatabase
+from bloom import BloomFilteredDatabase
+from build_uci import walk_edges, write_sidecar
+from cache import CachedDatabase
+from chess_hash import fen2blob
+from db import MOVE_SORT_COLUMNS, Database
+from model_file import MappedDatabase, write_model
+from selection import STRATEGIES
+from selfplay import play_games
+from uci import uci_sidecar
+
+RATINGS = range(5)
+GAMES_PER_RATING = 40
+PLIES = 10
+# Stored, but its only move leads to a position the model does not store
+LEAF_FEN = "8/8/8/8/8/8/8/KQ5k w - - 0 1"
+# Not stored, but has a move into a stored position
+UNSTORED_FEN = "8/8/8/8/8/8/8/KQ4k1 w - - 0 1"
+
+
+def random_move(board, rng):
+    legal = sorted(board.legal_moves, key=lambda move: move.uci())
+    return legal[min(int(rng.expovariate(0.7)), len(legal) - 1)]
+
+
+def sample_fens(count, seed):
+    """Start position and short random lines, many of them in the model."""
+    rng = random.Random(seed)
+    fens = [chess.STARTING_FEN, "8/8/8/8/8/8/8/K6k w - - 0 1"]
+    for _ in range(count):
+        board = chess.Board()
+        for _ in range(rng.randrange(PLIES)):
+            board.push(random_move(board, rng))
+        fens.append(board.fen())
+    return fens
+
+
+def build_model(file):
+    """A small model of random games in every rating band, with a .uci sidecar."""
+    rng = random.Random(7)
+    positions = {}
+    moves = {}
+    for rating in RATINGS:
+        for _ in range(GAMES_PER_RATING):
+            board = chess.Board()
+            result = rng.choice(("1-0", "0-1", "1/2-1/2"))
+            path = [fen2blob(board.fen(), rating)]
+            for _ in range(PLIES):
+                move = random_move(board, rng)
+                san = board.san(move)
+                board.push(move)
+                path.append(fen2blob(board.fen(), rating))
+                edge = moves.setdefault((path[-2], path[-1]), [san, 0, rating])
+                edge[1] += 1
+            for blob in set(path):
+                stats = positions.setdefault(blob, [0, 0, 0, rating])
+                stats[0] += 1
+                stats[1] += result == "1-0"
+                stats[2] += result == "0-1"
+    # A move into a position the model does not store, dropped by every backend
+    orphan_end = fen2blob("8/8/8/8/8/8/8/K6k w - - 0 1", 0)
+    moves[(fen2blob(chess.STARTING_FEN, 0), orphan_end)] = ["Kh1", 1, 0]
+    leaf = chess.Board(LEAF_FEN)
+    positions[fen2blob(LEAF_FEN, 0)] = [1, 1, 0, 0]
+    leaf.push_san("Qb8")
+    moves[(fen2blob(LEAF_FEN, 0), fen2blob(leaf.fen(), 0))] = ["Qb8", 1, 0]
+    moves[(fen2blob(UNSTORED_FEN, 0), fen2blob(LEAF_FEN, 0))] = ["Kh1", 1, 0]
+
+    connection = sqlite3.connect(file)
+    connection.execute(
+        """CREATE TABLE chessPosition (positionID BLOB PRIMARY KEY, timesPlayed INTEGER,
+        whiteWins INTEGER, blackWins INTEGER, recursiveScoreWhite REAL,
+        recursiveScoreBlack REAL, elo INTEGER)"""
+    )
+    connection.execute(
+        """CREATE TABLE chessMove (startPosition BLOB, endPosition BLOB, moveSAN TEXT,
+        timesPlayed INTEGER, elo INTEGER, PRIMARY KEY (startPosition, endPosition))"""
+    )
+    connection.executemany(
+        "INSERT INTO chessPosition VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [
+            (blob, played, white, black, rng.random(), rng.random(), rating)
+            for blob, (played, white, black, rating) in positions.items()
+        ],
+    )
+    connection.executemany(
+        "INSERT INTO chessMove VALUES (?, ?, ?, ?, ?)",
+        [(start, end, san, played, rating) for (start, end), (san, played, rating) in moves.items()],
+    )
+    connection.commit()
+    connection.close()
+
+    database = Database(file, immutable=False)
+    try:
+        write_sidecar(walk_edges(database), uci_sidecar(file))
+    finally:
+        database.close()
+
+
+@pytest.fixture(scope="module")
+def backends(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("model")
+    model = str(directory / "model.sqlite")
+    build_model(model)
+    database = Database(model)
+    arrays = ArrayDatabase(model)
+    model_file = str(directory / "model.cssm")
+    write_model(arrays, model_file)
+    mapped = MappedDatabase(model_file)
+    # The API's default stack: bloom filter -> cache -> SQLite
+    cached = CachedDatabase(Database(model), 10000, 16 * 1024 * 1024)
+    filtered = BloomFilteredDatabase.from_model(
+        CachedDatabase(Database(model), 10000, 16 * 1024 * 1024), model, 0.01, 1024 * 1024
+    )
+    backends = {
+        "sqlite": database,
+        "arrays": arrays,
+        "mmap": mapped,
+        "cached": cached,
+        "bloom": filtered,
+    }
+    yield backends
+    for backend in backends.values():
+        backend.close()
+
+
+@pytest.fixture(scope="module")
+def blobs():
+    return [fen2blob(fen, rating) for fen in sample_fens(60, seed=5) for rating in RATINGS]
+
+
+def by_san(moves):
+    return sorted(moves or [], key=lambda move: (move["moveSAN"], move["positionID"]))
+
+
+def assert_same(backends, lookup):
+    expected = lookup(backends["sqlite"])
+    for name, backend in backends.items():
+        # Twice, the second time from warm caches
+        assert lookup(backend) == expected, name
+        assert lookup(backend) == expected, name
+
+
+def test_model_is_not_trivial(backends, blobs):
+    database = backends["sqlite"]
+    assert sum(database.get_position_by_blob(blob) is not None for blob in blobs) > len(blobs) // 4
+    assert any(
+        move["moveUCI"] for blob in blobs for move in database.get_next_moves_by_blob(blob) or []
+    )
+
+
+def test_counts(backends):
+    assert_same(backends, lambda backend: backend.count_positions())
+
+
+def test_position(backends, blobs):
+    assert_same(backends, lambda backend: [backend.get_position_by_blob(blob) for blob in blobs])
+
+
+def test_positions_batch(backends, blobs):
+    assert_same(backends, lambda backend: backend.get_positions_by_blobs(blobs + blobs[:10]))
+
+
+def test_next_moves(backends, blobs):
+    assert_same(
+        backends, lambda backend: [by_san(backend.get_next_moves_by_blob(blob)) for blob in blobs]
+    )
+
+
+def test_next_moves_batch(backends, blobs):
+    assert_same(
+        backends,
+        lambda backend: {
+            blob: by_san(moves) for blob, moves in backend.get_next_moves_by_blobs(blobs).items()
+        },
+    )
+
+
+def test_orphan_end_move_dropped(backends):
+    for backend in backends.values():
+        sans = {move["moveSAN"] for move in backend.get_next_moves_by_fen(chess.STARTING_FEN, 0)}
+        assert "Kh1" not in sans
+
+
+def test_node_without_stored_moves(backends):
+    for name, backend in backends.items():
+        position, moves = backend.get_position_with_moves_by_fen(LEAF_FEN, 0)
+        assert position is not None and moves == [], name
+        assert backend.get_position_with_moves_by_fen(LEAF_FEN, 0, "moveSAN", 1) == (position, [])
+
+
+def test_unstored_start(backends):
+    for name, backend in backends.items():
+        assert backend.get_position_by_fen(UNSTORED_FEN, 0) is None, name
+        assert [move["moveSAN"] for move in backend.get_next_moves_by_fen(UNSTORED_FEN, 0)] == ["Kh1"], name
+        position, moves = backend.get_position_with_moves_by_fen(UNSTORED_FEN, 0)
+        assert position is None and [move["moveSAN"] for move in moves] == ["Kh1"], name
+    # The bloom filter of move starts is built from these
+    for name in ("sqlite", "arrays", "mmap"):
+        starts = {blob for batch in backends[name].iter_move_starts() for blob in batch}
+        assert fen2blob(UNSTORED_FEN, 0) in starts, name
+
+
+def test_node(backends, blobs):
+    def nodes(backend):
+        result = []
+        for blob in blobs:
+            position, moves = backend.get_position_with_moves_by_blob(blob)
+            result.append((position, by_san(moves)))
+        return result
+
+    assert_same(backends, nodes)
+
+
+@pytest.mark.parametrize("sort", ["recursiveScoreWhite", "recursiveScoreBlack"])
+def test_node_sorted(backends, blobs, sort):
+    # Random scores never tie, so the order is fully determined
+    assert sort in MOVE_SORT_COLUMNS
+    assert_same(
+        backends,
+        lambda backend: [backend.get_position_with_moves_by_blob(blob, sort, 2) for blob in blobs],
+    )
+
+
+def test_bands(backends):
+    def bands(backend):
+        result = []
+        for fen in sample_fens(20, seed=11):
+            for rating, (position, moves) in backend.get_bands_by_fen(fen, children=True).items():
+                result.append((rating, position, by_san(moves)))
+        return result
+
+    assert_same(backends, bands)
+
+
+@pytest.mark.parametrize("strategy", STRATEGIES)
+def test_select_move(backends, strategy):
+    def selected(backend):
+        result = []
+        for point in (0.0, 0.5, 0.99):
+            for fen in sample_fens(20, seed=13):
+                move = backend.select_move_by_fen(fen, 2, strategy, point)
+                result.append(move and move["moveSAN"])
+        return result
+
+    assert_same(backends, selected)
+
+
+def test_selfplay_seeded(backends):
+    def games(backend):
+        return play_games(backend, "avg_player", "recursive_best", 1, 2, [chess.STARTING_FEN] * 4, seed=9)
+
+    assert_same(backends, games)
+    # generate_openings draws from the same seed
+    database = backends["sqlite"]
+    args = (database, "recursive_best", "avg_player", 1, 2, [chess.STARTING_FEN] * 4, "avg", True)
+    assert play_games(*args, seed=4) == play_games(*args, seed=4)
+
+
+def test_selfplay_first_game(backends):
+    database = backends["sqlite"]
+    args = (database, "recursive_best", "avg_player_deterministic", 1, 2)
+    white, black, _ = play_games(*args, [chess.STARTING_FEN] * 3)
+    assert white != black
+    # A resumed run keeps the colours of its remaining games
+    assert play_games(*args, [chess.STARTING_FEN] * 2, first_game=1) == [black, white]
@@ -0,0 +1,43 @@
+from db import QUERY_CHUNK
+
+DEFAULT_MAX_NODES = 100000
+
+
+def walk_tree(database, root_blob, depth, min_played=0, max_nodes=DEFAULT_MAX_NODES):
+    """
+    Breadth-first walk of the move graph below a position, yielding
+    (depth, parent_blob, move, transposition) for every edge and
+    (0, None, root_position, False) for the root if it exists.
+    Each level is fetched with batched child-move lookups of QUERY_CHUNK
+    positions. Moves played fewer than `min_played` times are pruned, and a
+    position reached again by transposition is reported but not expanded.
+    Every listed position is kept to detect transpositions, so memory grows
+    with the walk; it stops after `max_nodes` edges (None for no limit).
+    """
+    root = database.get_position_by_blob(root_blob)
+    if root is not None:
+        yield 0, None, root, False
+    visited = {root_blob}
+    frontier = [root_blob]
+    nodes = 0
+    for level in range(1, depth + 1):
+        next_frontier = []
+        for start in range(0, len(frontier), QUERY_CHUNK):
+            chunk = frontier[start : start + QUERY_CHUNK]
+            next_moves = database.get_next_moves_by_blobs(chunk)
+            for parent_blob in chunk:
+                for move in next_moves.get(parent_blob, []):
+                    if move["move_times_played"] < min_played:
+                        continue
+                    if max_nodes is not None and nodes >= max_nodes:
+                        return
+                    nodes += 1
+                    child_blob = move["positionID"]
+                    transposition = child_blob in visited
+                    if not transposition:
+                        visited.add(child_blob)
+                        next_frontier.append(child_blob)
+                    yield level, parent_blob, move, transposition
+        frontier = next_frontier
+        if not frontier:
+            return
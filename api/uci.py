@@ -0,0 +1,49 @@
+import functools
+
+import chess
+
+# Edges without a known UCI are stored as 0: a1a1 is never a legal move
+UNKNOWN_UCI = 0
+UCI_SCHEMA = """startPosition BLOB NOT NULL,
+    endPosition BLOB NOT NULL,
+    uci INTEGER NOT NULL,
+    PRIMARY KEY (startPosition, endPosition)"""
+SAN_CACHE_ENTRIES = 65536
+
+
+def uci_sidecar(model_file):
+    return model_file + ".uci"
+
+
+def encode_uci(move):
+    """Pack a chess.Move into 16 bits: from | to << 6 | promotion << 12."""
+    return move.from_square | move.to_square << 6 | (move.promotion or 0) << 12
+
+
+def decode_uci(code):
+    if not code:
+        return None
+    return chess.Move(code & 63, code >> 6 & 63, code >> 12 or None).uci()
+
+
+@functools.lru_cache(maxsize=SAN_CACHE_ENTRIES)
+def san_to_uci(board_fen, san):
+    try:
+        return chess.Board(board_fen).parse_san(san).uci()
+    except ValueError:
+        return None
+
+
+def with_uci(fen, moves):
+    """
+    Fill in moveUCI for moves of `fen` that the model has none for (no
+    sidecar, or an edge the sidecar walk did not reach). Parses are cached
+    by position without move counters, so each edge is parsed once.
+    """
+    if all(move.get("moveUCI") for move in moves):
+        return moves
+    board_fen = " ".join(fen.split()[:4]) + " 0 1"
+    return [
+        move if move.get("moveUCI") else dict(move, moveUCI=san_to_uci(board_fen, move["moveSAN"]))
+        for move in moves
+    ]
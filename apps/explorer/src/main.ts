@@ -631,8 +631,14 @@ async function engineTurn() {
       endBlitz("No engine moves available (under 2% play rate).");
       return;
     }
-    // Play SAN from API
-    const engineMove = blitzGame.move(best.moveSAN);
+    // Play UCI from API if the model has it, SAN otherwise
+    const engineMove = best.moveUCI
+      ? blitzGame.move({
+          from: best.moveUCI.slice(0, 2),
+          to: best.moveUCI.slice(2, 4),
+          promotion: best.moveUCI.slice(4) || undefined,
+        })
+      : blitzGame.move(best.moveSAN);
     if (!engineMove) {
       setBlitzStatus("Engine provided illegal move.");
       endBlitz("Game stopped due to engine error.");
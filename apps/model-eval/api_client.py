@@ -0,0 +1,201 @@
+import base64
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+RETRY_STATUS = (502, 503, 504)
+# POST /selfplay plays whole pairings per request
+SELFPLAY_TIMEOUT = 600
+BUSY_TIMEOUT = 30
+
+
+def encode_fen(fen):
+    return base64.b64encode(fen.encode("utf-8")).decode("utf-8")
+
+
+class ResponseCache:
+    """
+    Response bodies by URL in a WAL-mode SQLite file, shared by runs and
+    worker processes. Only valid while the served model does not change.
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.local = threading.local()
+        self.connection
+
+    @property
+    def connection(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None or self.local.pid != os.getpid():
+            connection = sqlite3.connect(self.file, timeout=BUSY_TIMEOUT)
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = NORMAL")
+            with connection:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS response (url TEXT PRIMARY KEY, body TEXT NOT NULL)"
+                )
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return connection
+
+    def get(self, url):
+        row = self.connection.execute("SELECT body FROM response WHERE url = ?", (url,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, url, body):
+        with self.connection as connection:
+            connection.execute("INSERT OR REPLACE INTO response VALUES (?, ?)", (url, body))
+
+    def close(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is not None and self.local.pid == os.getpid():
+            connection.close()
+        self.local = threading.local()
+
+
+class ApiClient:
+    """
+    Client for the chessScoreSuite API over one keep-alive session.
+    Connection errors, timeouts and 502/503/504 answers (503 is the API's
+    "Database queue full") are retried `retries` times with exponential
+    backoff. Decoded JSON is returned, or None if the request failed;
+    error responses ({"error": ...}) are returned as they are. With
+    `cache_file`, successful GET responses are stored on disk and reused.
+    """
+
+    def __init__(
+        self,
+        base_url,
+        timeout=5,
+        retries=3,
+        backoff=0.1,
+        pool_size=10,
+        cache_file=None,
+    ):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.cache = ResponseCache(cache_file) if cache_file else None
+        self.requests = 0
+        self.retried = 0
+        self.failures = 0
+        self.cache_hits = 0
+        self.seconds = 0.0
+
+    def request(self, method, path, timeout=None, retries=None, **kwargs):
+        url = self.base_url + path
+        if retries is None:
+            retries = self.retries
+        for attempt in range(retries + 1):
+            if attempt:
+                self.retried += 1
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            start = time.perf_counter()
+            try:
+                response = self.session.request(
+                    method, url, timeout=timeout or self.timeout, **kwargs
+                )
+            except (requests.ConnectionError, requests.Timeout):
+                continue
+            except requests.RequestException:
+                # Bad responses or URLs do not get better on a retry
+                break
+            finally:
+                self.requests += 1
+                self.seconds += time.perf_counter() - start
+            if response.status_code in RETRY_STATUS:
+                continue
+            if not response.ok:
+                break
+            return response
+        self.failures += 1
+        return None
+
+    def url(self, path, params=None):
+        """Full URL of a GET request, the key of its cached response."""
+        return requests.Request("GET", self.base_url + path, params=params).prepare().url
+
+    def get(self, path, params=None):
+        """Decoded JSON of a GET request, or None if it failed."""
+        try:
+            url = self.url(path, params)
+        except requests.RequestException:
+            self.failures += 1
+            return None
+        if self.cache is not None:
+            body = self.cache.get(url)
+            if body is not None:
+                self.cache_hits += 1
+                return json.loads(body)
+        response = self.request("GET", path, params=params)
+        if response is None:
+            return None
+        try:
+            data = response.json()
+        except ValueError:
+            self.failures += 1
+            return None
+        if self.cache is not None:
+            self.cache.put(url, response.text)
+        return data
+
+    def post(self, path, payload, timeout=None, retries=None):
+        response = self.request("POST", path, timeout=timeout, retries=retries, json=payload)
+        if response is None:
+            return None
+        try:
+            return response.json()
+        except ValueError:
+            self.failures += 1
+            return None
+
+    def node(self, fen, rating):
+        """Position stats and child moves: {"position", "moves"}."""
+        return self.get(f"/fen/{encode_fen(fen)}/{rating}/node")
+
+    def bands(self, fen, ratings, children=True):
+        """Nodes of one position in several rating bands with one request."""
+        data = self.get(
+            f"/fen/{encode_fen(fen)}/bands",
+            {"ratings": ",".join(str(r) for r in ratings), "children": str(children).lower()},
+        )
+        if not isinstance(data, dict) or "error" in data:
+            return None
+        return {int(rating): node for rating, node in data.items()}
+
+    def positions(self, queries):
+        """Position stats for many {"fen", "rating"} or {"hash"} queries, in order."""
+        return self.post("/positions", {"positions": queries})
+
+    def selfplay(self, **request):
+        """
+        One series per game played on the server, see POST /selfplay. Not
+        retried: the server keeps playing a batch whose request timed out,
+        so a retry would only queue the same games again.
+        """
+        return self.post("/selfplay", request, timeout=SELFPLAY_TIMEOUT, retries=0)
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "retries": self.retried,
+            "failures": self.failures,
+            "cacheHits": self.cache_hits,
+            "meanLatencyMs": 1000 * self.seconds / self.requests if self.requests else 0.0,
+        }
+
+    def close(self):
+        self.session.close()
+        if self.cache is not None:
+            self.cache.close()
@@ -0,0 +1,8 @@
+# Makes the API modules (chess_hash, cache, db, ...) importable from model-eval.
+# Appended, not prepended, so model-eval's own main.py is not shadowed.
+import os
+import sys
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "api")
+if API_DIR not in sys.path:
+    sys.path.append(API_DIR)
@@ -0,0 +1,263 @@
+import asyncio
+import base64
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import chess
+import httpx
+import requests
+
+import engines
+from api_client import RETRY_STATUS
+
+DEFAULT_IN_FLIGHT = 64
+
+# API strategy of each database engine, see /fen/{fen}/{rating}/select
+STRATEGY_NAMES = {
+    fn: name for name, fn in engines.ENGINE_FUNCTIONS.items() if fn is not engines.sf_best_move
+}
+
+
+def parse_uci(uci):
+    """The move of a UCI string, or None if it is not one."""
+    try:
+        return chess.Move.from_uci(uci)
+    except ValueError:
+        return None
+
+
+def fen_path(board, elo):
+    fen_encoded = base64.b64encode(board.fen().encode("utf-8")).decode("utf-8")
+    return f"/fen/{fen_encoded}/{elo}"
+
+
+class AsyncApi:
+    """
+    Asynchronous side of an ApiClient, shared by all games of a run. It
+    uses the client's base URL, timeout, retries, backoff and response
+    cache, and counts its requests in the client's stats(). At most
+    `in_flight` requests are outstanding at once, further requests wait
+    for a slot.
+    """
+
+    def __init__(self, api, in_flight=DEFAULT_IN_FLIGHT):
+        self.api = api
+        self.client = httpx.AsyncClient(
+            timeout=api.timeout,
+            limits=httpx.Limits(max_connections=in_flight, max_keepalive_connections=in_flight),
+        )
+        self.slots = asyncio.Semaphore(in_flight)
+
+    async def request(self, url):
+        """ApiClient.request for a GET, awaiting the backoff."""
+        api = self.api
+        for attempt in range(api.retries + 1):
+            if attempt:
+                api.retried += 1
+                await asyncio.sleep(api.backoff * 2 ** (attempt - 1))
+            async with self.slots:
+                start = time.perf_counter()
+                try:
+                    response = await self.client.get(url)
+                except (httpx.TimeoutException, httpx.NetworkError, httpx.RemoteProtocolError):
+                    continue
+                except httpx.HTTPError:
+                    break
+                finally:
+                    api.requests += 1
+                    api.seconds += time.perf_counter() - start
+            if response.status_code in RETRY_STATUS:
+                continue
+            if not response.is_success:
+                break
+            return response
+        api.failures += 1
+        return None
+
+    async def get(self, path, **params):
+        """Decoded JSON of a GET request, or None on errors and error responses."""
+        api = self.api
+        try:
+            url = api.url(path, params)
+        except requests.RequestException:
+            api.failures += 1
+            return None
+        body = api.cache.get(url) if api.cache is not None else None
+        if body is not None:
+            api.cache_hits += 1
+            data = json.loads(body)
+        else:
+            response = await self.request(url)
+            if response is None:
+                return None
+            try:
+                data = response.json()
+            except ValueError:
+                api.failures += 1
+                return None
+            if api.cache is not None:
+                api.cache.put(url, response.text)
+        if isinstance(data, dict) and "error" in data:
+            return None
+        return data
+
+    async def close(self):
+        await self.client.aclose()
+
+
+class AsyncGameRunner:
+    """
+    Plays game jobs (see main.game_jobs) concurrently in one event loop.
+    Database engines pick moves with a single /select request, so games
+    mostly wait on the API; Stockfish moves and evals run on a thread pool
+    sized to the engine pool. Every game draws its avg_player seeds from
+    its own generator derived from `seed`. With `done`, done(index,
+    result) is called as each game ends.
+    """
+
+    def __init__(self, in_flight=DEFAULT_IN_FLIGHT, sf_threads=1, seed=None):
+        self.in_flight = in_flight
+        self.sf_threads = sf_threads
+        self.seed = seed
+
+    def play(self, jobs, done=None):
+        """Results of all jobs, in job order."""
+        rng = random.Random(self.seed)
+        rngs = [random.Random(rng.getrandbits(64)) for _ in jobs]
+        with ThreadPoolExecutor(self.sf_threads, thread_name_prefix="stockfish") as executor:
+            return asyncio.run(self.play_all(jobs, rngs, executor, done))
+
+    async def play_all(self, jobs, rngs, executor, done):
+        api = AsyncApi(engines.data_source(), self.in_flight)
+
+        async def play_one(index, job, game_rng):
+            result = await play_job(api, job, game_rng, executor)
+            if done is not None:
+                done(index, result)
+            return result
+
+        try:
+            return await asyncio.gather(
+                *(play_one(i, job, game_rng) for i, (job, game_rng) in enumerate(zip(jobs, rngs)))
+            )
+        finally:
+            await api.close()
+
+
+async def select_move(api, board, elo, strategy, rng):
+    params = {"strategy": strategy}
+    if strategy == "avg_player":
+        params["seed"] = rng.getrandbits(32)
+    data = await api.get(fen_path(board, elo) + "/select", **params)
+    if not data or not data.get("move"):
+        return None
+    return parse_uci(data["move"])
+
+
+async def engine_move(api, engine_fn, board, elo, rng, executor):
+    if engine_fn is engines.sf_best_move:
+        loop = asyncio.get_running_loop()
+        uci = await loop.run_in_executor(executor, engines.sf_best_move, board.copy())
+        return parse_uci(uci) if uci else None
+    return await select_move(api, board, elo, STRATEGY_NAMES[engine_fn], rng)
+
+
+async def evaluate(api, eval_function, board, elo, executor):
+    if eval_function is engines.eval_pos:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, engines.eval_pos, board.copy())
+    # engines.eval_pos_avg
+    data = await api.get(fen_path(board, elo) + "/position")
+    if not data or not data.get("timesPlayed"):
+        return None
+    return data["whiteWins"] / data["timesPlayed"] - 0.5
+
+
+async def move_frequency(api, board, elo, move):
+    """engines.move_frequency over the shared client."""
+    data = await api.get(fen_path(board, elo) + "/node")
+    moves_data = data.get("moves") if data else None
+    if not moves_data:
+        return None
+    uci = move.uci()
+    chosen = next((m for m in moves_data if m.get("moveUCI") == uci), None)
+    if chosen is None:
+        san = board.san(move)
+        chosen = next(
+            (m for m in moves_data if not m.get("moveUCI") and m.get("moveSAN") == san), None
+        )
+    if chosen is None:
+        return None
+    parent_times = (data.get("position") or {}).get("timesPlayed") or 0
+    if parent_times <= 0:
+        parent_times = sum(m.get("move_times_played") or 0 for m in moves_data)
+    if parent_times > 0:
+        return (chosen.get("move_times_played") or 0) / parent_times
+    return None
+
+
+async def generate_opening_fen(api, rng, moves=4, elo=2):
+    """main.generate_opening_fen with the avg_player strategy."""
+    board = chess.Board(chess.STARTING_FEN)
+    for _ in range(moves):
+        if board.is_game_over(claim_draw=True):
+            break
+        move = await select_move(api, board, elo, "avg_player", rng)
+        if move is None or move not in board.legal_moves:
+            break
+        board.push(move)
+    return board.fen()
+
+
+async def play_job(api, job, rng, executor):
+    """main.play_job: the same game as main.play_game, one await per lookup."""
+    (
+        status,
+        evaluated_fn,
+        baseline_fn,
+        eval_function,
+        fen,
+        evaluated_color,
+        evaluated_elo,
+        baseline_elo,
+        generate_openings,
+        record_move_frequency,
+        max_moves,
+    ) = job
+    print(status)
+    if generate_openings:
+        fen = await generate_opening_fen(api, rng, moves=4, elo=baseline_elo)
+
+    board = chess.Board(fen)
+    evaluations = []
+    move_count = 0
+    while not board.is_game_over(claim_draw=True):
+        if max_moves is not None and move_count >= max_moves:
+            break
+
+        if not record_move_frequency:
+            eval_value = await evaluate(api, eval_function, board, evaluated_elo, executor)
+            if eval_value is not None:
+                if evaluated_color == chess.BLACK:
+                    eval_value = -eval_value
+                evaluations.append(eval_value)
+
+        current_color = board.turn
+        if current_color == evaluated_color:
+            move = await engine_move(api, evaluated_fn, board, evaluated_elo, rng, executor)
+        else:
+            move = await engine_move(api, baseline_fn, board, baseline_elo, rng, executor)
+        if move is None or move not in board.legal_moves:
+            break
+
+        if record_move_frequency and current_color == evaluated_color:
+            freq = await move_frequency(api, board, evaluated_elo, move)
+            if freq is not None:
+                evaluations.append(freq)
+
+        board.push(move)
+        move_count += 1
+
+    return evaluations
@@ -0,0 +1,76 @@
+import api_modules  # noqa: F401
+from array_db import ArrayDatabase
+from db import Database
+from model_file import MappedDatabase
+from selfplay import play_games
+from uci import with_uci
+
+MODEL_FILE = "../../models/results.sqlite"
+# Backends of api/main.py's DB_BACKEND
+BACKENDS = {
+    "sqlite": Database,
+    "arrays": ArrayDatabase,
+    "mmap": MappedDatabase,
+}
+
+
+class LocalSource:
+    """
+    In-process stand-in for ApiClient: answers node() and bands() straight
+    from one of the API's model backends, in the shape of the HTTP
+    responses the engines read. No server, sockets or JSON involved.
+    """
+
+    def __init__(self, backend="sqlite", file=MODEL_FILE):
+        self.database = BACKENDS[backend](file)
+        self.lookups = 0
+
+    def node(self, fen, rating):
+        """Position stats and child moves: {"position", "moves"}."""
+        self.lookups += 1
+        position, moves = self.database.get_position_with_moves_by_fen(fen, rating)
+        return {"position": position, "moves": with_uci(fen, moves)}
+
+    def bands(self, fen, ratings, children=True):
+        """Nodes of one position in several rating bands with one lookup."""
+        self.lookups += 1
+        bands = self.database.get_bands_by_fen(fen, ratings, children)
+        return {
+            rating: {"position": position, "moves": with_uci(fen, moves)}
+            for rating, (position, moves) in bands.items()
+        }
+
+    def selfplay(
+        self,
+        evaluated,
+        baseline,
+        evaluated_rating,
+        baseline_rating,
+        openings,
+        series="avg",
+        generate_openings=False,
+        max_moves=None,
+        seed=None,
+        first_game=0,
+    ):
+        """ApiClient.selfplay, played in this process."""
+        self.lookups += 1
+        return play_games(
+            self.database,
+            evaluated,
+            baseline,
+            evaluated_rating,
+            baseline_rating,
+            openings,
+            series,
+            generate_openings,
+            max_moves,
+            seed,
+            first_game,
+        )
+
+    def stats(self):
+        return {"lookups": self.lookups}
+
+    def close(self):
+        self.database.close()
@@ -0,0 +1,126 @@
+import threading
+from contextlib import contextmanager
+
+import chess.engine
+
+
+class EnginePool:
+    """
+    Long-lived UCI engines for the Stockfish engine and eval functions.
+    Engines are started lazily, at most `size` of them; borrow() hands one
+    out exclusively and blocks while all are busy. An idle engine that
+    fails its health check, or one that raised while borrowed, is closed
+    and replaced by a fresh process on the next borrow.
+    """
+
+    def __init__(self, path, size=1, threads=1, hash_mb=16):
+        self.path = path
+        self.size = size
+        self.options = {"Threads": threads, "Hash": hash_mb}
+        self.slots = threading.BoundedSemaphore(size)
+        self.lock = threading.Lock()
+        self.idle = []
+        self.started = 0
+        self.restarts = 0
+        self.closed = False
+        self.name = None
+
+    def start_engine(self):
+        engine = chess.engine.SimpleEngine.popen_uci(self.path)
+        engine.configure(self.options)
+        with self.lock:
+            self.started += 1
+            self.name = engine.id.get("name", self.path)
+        return engine
+
+    def healthy(self, engine):
+        try:
+            engine.ping()
+            return True
+        except (chess.engine.EngineError, TimeoutError):
+            return False
+
+    def discard(self, engine):
+        with self.lock:
+            self.restarts += 1
+        try:
+            engine.close()
+        except (chess.engine.EngineError, TimeoutError, OSError):
+            pass
+
+    def acquire(self):
+        self.slots.acquire()
+        try:
+            with self.lock:
+                if self.closed:
+                    raise RuntimeError("Engine pool is closed")
+                engine = self.idle.pop() if self.idle else None
+            if engine is not None and not self.healthy(engine):
+                print("Stockfish engine failed its health check, restarting")
+                self.discard(engine)
+                engine = None
+            if engine is None:
+                engine = self.start_engine()
+            return engine
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def release(self, engine, broken=False):
+        if broken:
+            self.discard(engine)
+        else:
+            with self.lock:
+                closed = self.closed
+                if not closed:
+                    self.idle.append(engine)
+            # Borrowed while the pool was closed, quit it like close() would
+            if closed:
+                self.quit(engine)
+        self.slots.release()
+
+    @contextmanager
+    def borrow(self):
+        engine = self.acquire()
+        try:
+            yield engine
+        except BaseException:
+            # The engine may be mid-search or dead, never hand it out again
+            self.release(engine, broken=True)
+            raise
+        self.release(engine)
+
+    def run(self, fn):
+        """Call fn(engine), retrying once on a fresh engine if it crashed."""
+        try:
+            with self.borrow() as engine:
+                return fn(engine)
+        except chess.engine.EngineTerminatedError:
+            print("Stockfish engine terminated, restarting")
+        with self.borrow() as engine:
+            return fn(engine)
+
+    def identity(self):
+        """Engine name from the UCI handshake, starting an engine if needed."""
+        if self.name is None:
+            with self.borrow():
+                pass
+        return self.name
+
+    def quit(self, engine):
+        try:
+            engine.quit()
+        except (chess.engine.EngineError, TimeoutError):
+            pass
+        engine.close()
+
+    def close(self):
+        """Quit the idle engines now and borrowed ones when they come back."""
+        with self.lock:
+            self.closed = True
+            engines, self.idle = self.idle, []
+        for engine in engines:
+            self.quit(engine)
+
+    def stats(self):
+        return {"size": self.size, "started": self.started, "restarts": self.restarts}
@@ -1,32 +1,188 @@
 # KI-generierter code
-import base64
+import os
 import random
-import requests
 
 import chess
 import chess.engine
+import api_modules  # noqa: F401
+from api_client import ApiClient
+from cache import MISSING, LRUCache
+from chess_hash import fen2blob
+from data_source import LocalSource
+from engine_pool import EnginePool
+from eval_cache import EvalCache
 
 STOCKFISH_PATH = "/usr/bin/stockfish"
 API_BASE_URL = "http://localhost:5554"
 
+EVAL_LIMIT = chess.engine.Limit(depth=1)
+
+_engine_pool = None
+_eval_cache = None
+_eval_engine = None
+_data_source = None
+_data_source_pid = None
+_data_source_options = {"source": "http"}
+# Read-only model, so bundles never go stale within a run
+_bundles = LRUCache(100000, 64 * 1024 * 1024)
+
+
+def configure_data_source(source="http", **options):
+    """
+    Choose where the database engines look positions up: "http" for an
+    ApiClient to API_BASE_URL, or a data_source.BACKENDS name to open the
+    model in-process. `options` go to ApiClient or LocalSource; each
+    process opens its own source on first use.
+    """
+    global _data_source_options
+    close_data_source()
+    _data_source_options = dict(options, source=source)
+
+
+def data_source():
+    """The ApiClient or LocalSource of this process."""
+    global _data_source, _data_source_pid
+    if _data_source is None or _data_source_pid != os.getpid():
+        options = dict(_data_source_options)
+        source = options.pop("source")
+        if source == "http":
+            options.setdefault("base_url", API_BASE_URL)
+            _data_source = ApiClient(**options)
+        else:
+            _data_source = LocalSource(source, **options)
+        _data_source_pid = os.getpid()
+    return _data_source
+
+
+def data_source_stats():
+    """Counters of this process's data source, None if it was never used."""
+    if _data_source is None or _data_source_pid != os.getpid():
+        return None
+    return _data_source.stats()
+
+
+def close_data_source():
+    global _data_source
+    if _data_source is not None and _data_source_pid == os.getpid():
+        _data_source.close()
+    _data_source = None
+
+
+def configure_engine_pool(size=1, threads=1, hash_mb=16):
+    """Replace the Stockfish pool used by sf_best_move and eval_pos."""
+    global _engine_pool
+    close_engine_pool()
+    _engine_pool = EnginePool(STOCKFISH_PATH, size, threads, hash_mb)
+    return _engine_pool
+
+
+def engine_pool():
+    if _engine_pool is None:
+        configure_engine_pool()
+    return _engine_pool
+
+
+def close_engine_pool():
+    """
+    Quit the pooled engines. Must be called before exit: python-chess runs
+    each engine on a non-daemon thread, which would keep the process alive.
+    """
+    global _engine_pool
+    if _engine_pool is not None:
+        _engine_pool.close()
+        _engine_pool = None
+
+
+def move_notation(move):
+    """UCI of an API move if the model knows it, else SAN."""
+    return move.get("moveUCI") or move["moveSAN"]
+
+
+def configure_eval_cache(file, max_entries=100000):
+    """Cache eval_pos results in `file`; None disables the cache."""
+    global _eval_cache, _eval_engine
+    close_eval_cache()
+    if file:
+        _eval_cache = EvalCache(file, max_entries)
+        # Part of every key; the handshake name does not change within a run
+        _eval_engine = engine_pool().identity()
+    return _eval_cache
+
+
+def close_eval_cache():
+    global _eval_cache
+    if _eval_cache is not None:
+        _eval_cache.close()
+        _eval_cache = None
+
 
 def sf_best_move(board):
     print("STARTING CHESS MOVE")
-    with chess.engine.SimpleEngine.popen_uci(STOCKFISH_PATH) as engine:
-        result = engine.play(board, chess.engine.Limit(time=0.05))
-        if result.move is None:
-            return None
-        print("CHESS MOVE DONE")
-        return result.move.uci()
+    result = engine_pool().run(
+        lambda engine: engine.play(board, chess.engine.Limit(time=0.05))
+    )
+    if result.move is None:
+        return None
+    print("CHESS MOVE DONE")
+    return result.move.uci()
 
 
 def eval_pos(board):
-    with chess.engine.SimpleEngine.popen_uci(STOCKFISH_PATH) as engine:
-        info = engine.analyse(board, chess.engine.Limit(depth=1))
-        if "score" not in info:
-            return None
-        score = info["score"].white()
-        return score.score(mate_score=10000)
+    cache = _eval_cache
+    if cache is not None:
+        key = cache.key(board, EVAL_LIMIT, _eval_engine)
+        cached = cache.get(key)
+        if cached is not MISSING:
+            return cached
+
+    info = engine_pool().run(lambda engine: engine.analyse(board, EVAL_LIMIT))
+    value = None
+    if "score" in info:
+        value = info["score"].white().score(mate_score=10000)
+    if cache is not None:
+        cache.put(key, value)
+    return value
+
+
+def position_bundle(position, elo):
+    """
+    Stats and child moves of a position from one data source lookup
+    (a /node request over HTTP): {"position": dict or None, "moves": list}.
+    Memoized per process by (hash, rating), so the eval, engine and
+    move_frequency lookups of a ply share one lookup. Returns None if the
+    lookup fails.
+    """
+    fen = position.fen()
+    key = fen2blob(fen, elo)
+    bundle = _bundles.get(key)
+    if bundle is not MISSING:
+        return bundle
+
+    bundle = data_source().node(fen, elo)
+    if not isinstance(bundle, dict) or not isinstance(bundle.get("moves"), list):
+        return None
+    _bundles.put(key, bundle)
+    return bundle
+
+
+def prefetch_bundles(position, elos):
+    """Fetch the bundles of a position in several ratings with one lookup."""
+    fen = position.fen()
+    missing = [elo for elo in set(elos) if _bundles.get(fen2blob(fen, elo)) is MISSING]
+    if len(missing) < 2:
+        return
+    nodes = data_source().bands(fen, sorted(missing))
+    for elo, bundle in (nodes or {}).items():
+        if isinstance(bundle.get("moves"), list):
+            _bundles.put(fen2blob(fen, elo), bundle)
+
+
+def bundle_moves(position, elo):
+    """Child moves of a position, or None if there are none."""
+    bundle = position_bundle(position, elo)
+    if bundle is None or not bundle["moves"]:
+        return None
+    return bundle["moves"]
 
 
 def move_frequency(position: chess.Board, elo: int, move: chess.Move):
@@ -35,87 +191,62 @@ def move_frequency(position: chess.Board, elo: int, move: chess.Move):
       move_times_played / parent_position.timesPlayed
     Falls back to sum(move_times_played) if timesPlayed is unavailable.
     """
-    try:
-        san = position.san(move)
-    except Exception:
+    bundle = position_bundle(position, elo)
+    if bundle is None or not bundle["moves"]:
         return None
+    moves_data = bundle["moves"]
 
-    fen_encoded = base64.b64encode(position.fen().encode("utf-8")).decode("utf-8")
-    url_moves = f"{API_BASE_URL}/fen/{fen_encoded}/{elo}/moves"
-    url_pos = f"{API_BASE_URL}/fen/{fen_encoded}/{elo}/position"
-
-    parent_times = 0
     try:
-        resp_pos = requests.get(url_pos, timeout=5)
-        resp_pos.raise_for_status()
-        pos_data = resp_pos.json()
+        parent_times = 0
+        pos_data = bundle.get("position")
         if isinstance(pos_data, dict):
             parent_times = int(pos_data.get("timesPlayed", 0) or 0)
-    except (requests.RequestException, ValueError, TypeError):
-        parent_times = 0
 
-    try:
-        resp_moves = requests.get(url_moves, timeout=5)
-        resp_moves.raise_for_status()
-        moves_data = resp_moves.json()
-        if not isinstance(moves_data, list) or not moves_data:
-            return None
-
-        # Find the chosen move
-        chosen = next((m for m in moves_data if m.get("moveSAN") == san), None)
+        # Find the chosen move, by SAN only if the API has no UCI for it
+        uci = move.uci()
+        chosen = next((m for m in moves_data if m.get("moveUCI") == uci), None)
+        if chosen is None:
+            try:
+                san = position.san(move)
+            except Exception:
+                return None
+            chosen = next(
+                (m for m in moves_data if not m.get("moveUCI") and m.get("moveSAN") == san),
+                None,
+            )
         if chosen is None:
             return None
 
         # Fallback denominator if timesPlayed wasn't available
         if parent_times <= 0:
-            try:
-                parent_times = sum(
-                    int(m.get("move_times_played", 0) or 0) for m in moves_data
-                )
-            except Exception:
-                parent_times = 0
+            parent_times = sum(int(m.get("move_times_played", 0) or 0) for m in moves_data)
 
         if parent_times > 0:
             num = int(chosen.get("move_times_played", 0) or 0)
             return num / parent_times
 
         return None
-    except (requests.RequestException, ValueError, TypeError):
+    except (AttributeError, ValueError, TypeError):
         return None
 
 
 def avg_player_move(position, elo):
-
-    # Encode FEN position for URL
-    fen_encoded = base64.b64encode(position.fen().encode("utf-8")).decode("utf-8")
-
-    url = f"{API_BASE_URL}/fen/{fen_encoded}/{elo}/moves"
-
-    try:
-        response = requests.get(url, timeout=5)
-        response.raise_for_status()
-        moves_data = response.json()
-
-        if isinstance(moves_data, list) and moves_data:
-            # Use weighted random choice based on move_times_played
-            moves = [move["moveSAN"] for move in moves_data]
-            weights = [move["move_times_played"] for move in moves_data]
-            return random.choices(moves, weights=weights)[0]
-
+    moves_data = bundle_moves(position, elo)
+    if moves_data is None:
         return None
-    except (requests.RequestException, KeyError, ValueError):
+    try:
+        # Use weighted random choice based on move_times_played
+        moves = [move_notation(move) for move in moves_data]
+        weights = [move["move_times_played"] for move in moves_data]
+        return random.choices(moves, weights=weights)[0]
+    except (KeyError, ValueError):
         return None
 
 
 def eval_pos_avg(position, elo):
-    # Encode FEN position for URL
-    fen_encoded = base64.b64encode(position.fen().encode("utf-8")).decode("utf-8")
-    url = f"{API_BASE_URL}/fen/{fen_encoded}/{elo}/position"
+    bundle = position_bundle(position, elo)
+    position_data = bundle.get("position") if bundle else None
     try:
-        response = requests.get(url, timeout=5)
-        response.raise_for_status()
-        position_data = response.json()
-
         if (
             position_data
             and "whiteWins" in position_data
@@ -129,7 +260,7 @@ def eval_pos_avg(position, elo):
                 return avg_winning_rate - 0.5
 
         return None
-    except (requests.RequestException, KeyError, ValueError):
+    except (KeyError, ValueError):
         return None
 
 
@@ -138,43 +269,34 @@ def avg_best_move(position, elo):
     Get the move with the highest average performance (best win rate)
     from the API data for a given position and ELO rating.
     """
-    # Encode FEN position for URL
-    fen_encoded = base64.b64encode(position.fen().encode("utf-8")).decode("utf-8")
-
-    url = f"{API_BASE_URL}/fen/{fen_encoded}/{elo}/moves"
-
-    try:
-        response = requests.get(url, timeout=5)
-        response.raise_for_status()
-        moves_data = response.json()
-
-        if isinstance(moves_data, list) and moves_data:
-            # Find move with best winning percentage
-            best_move = None
-            best_score = -1
-
-            for move in moves_data:
-                if (
-                    "whiteWins" in move
-                    and "timesPlayed" in move
-                    and move["timesPlayed"] > 0
-                ):
-                    win_rate = move["whiteWins"] / move["timesPlayed"]
-
-                    # Adjust score based on whose turn it is
-                    if position.turn == chess.WHITE:
-                        score = win_rate
-                    else:
-                        score = 1 - win_rate  # Black wants low white win rate
-
-                    if score > best_score:
-                        best_score = score
-                        best_move = move["moveSAN"]
-
-            return best_move
-
+    moves_data = bundle_moves(position, elo)
+    if moves_data is None:
         return None
-    except (requests.RequestException, KeyError, ValueError):
+    try:
+        # Find move with best winning percentage
+        best_move = None
+        best_score = -1
+
+        for move in moves_data:
+            if (
+                "whiteWins" in move
+                and "timesPlayed" in move
+                and move["timesPlayed"] > 0
+            ):
+                win_rate = move["whiteWins"] / move["timesPlayed"]
+
+                # Adjust score based on whose turn it is
+                if position.turn == chess.WHITE:
+                    score = win_rate
+                else:
+                    score = 1 - win_rate  # Black wants low white win rate
+
+                if score > best_score:
+                    best_score = score
+                    best_move = move_notation(move)
+
+        return best_move
+    except (KeyError, ValueError):
         return None
 
 
@@ -183,48 +305,30 @@ def avg_player_move_deterministic(position, elo):
     Get the most commonly played move for a given position and ELO rating.
     Returns the move with the highest move_times_played count.
     """
-    # Encode FEN position for URL
-    fen_encoded = base64.b64encode(position.fen().encode("utf-8")).decode("utf-8")
-
-    url = f"{API_BASE_URL}/fen/{fen_encoded}/{elo}/moves"
-
-    try:
-        response = requests.get(url, timeout=5)
-        response.raise_for_status()
-        moves_data = response.json()
-
-        if isinstance(moves_data, list) and moves_data:
-            # Find move with highest play count
-            most_common_move = max(moves_data, key=lambda x: x["move_times_played"])
-            return most_common_move["moveSAN"]
-
+    moves_data = bundle_moves(position, elo)
+    if moves_data is None:
         return None
-    except (requests.RequestException, KeyError, ValueError):
+    try:
+        # Find move with highest play count
+        most_common_move = max(moves_data, key=lambda x: x["move_times_played"])
+        return move_notation(most_common_move)
+    except (KeyError, ValueError):
         return None
 
 
 def recursivebest_move(position, elo, color):
-    # Encode FEN position for URL
-    fen_encoded = base64.b64encode(position.fen().encode("utf-8")).decode("utf-8")
-
-    url = f"{API_BASE_URL}/fen/{fen_encoded}/{elo}/moves"
-
-    try:
-        response = requests.get(url, timeout=5)
-        response.raise_for_status()
-        moves_data = response.json()
-
-        if isinstance(moves_data, list) and moves_data:
-            # Choose move with best recursive score for the given color
-            if color == True:
-                best_move = max(moves_data, key=lambda x: x["recursiveScoreWhite"])
-            else:  # black
-                best_move = max(moves_data, key=lambda x: x["recursiveScoreBlack"])
-
-            return best_move["moveSAN"]
-
+    moves_data = bundle_moves(position, elo)
+    if moves_data is None:
         return None
-    except (requests.RequestException, KeyError, ValueError):
+    try:
+        # Choose move with best recursive score for the given color
+        if color == True:
+            best_move = max(moves_data, key=lambda x: x["recursiveScoreWhite"])
+        else:  # black
+            best_move = max(moves_data, key=lambda x: x["recursiveScoreBlack"])
+
+        return move_notation(best_move)
+    except (KeyError, ValueError):
         return None
 
 
@@ -233,28 +337,19 @@ def recursiveworst_move(position, elo, color):
     Chooses the move that is worst for the current player,
     i.e., the move that leads to the opponent's highest recursive score.
     """
-    # Encode FEN position for URL
-    fen_encoded = base64.b64encode(position.fen().encode("utf-8")).decode("utf-8")
-
-    url = f"{API_BASE_URL}/fen/{fen_encoded}/{elo}/moves"
-
-    try:
-        response = requests.get(url, timeout=5)
-        response.raise_for_status()
-        moves_data = response.json()
-
-        if isinstance(moves_data, list) and moves_data:
-            # For WHITE, pick move maximizing opponent's recursiveScoreBlack
-            # For BLACK, pick move maximizing opponent's recursiveScoreWhite
-            if color is True:  # White to move
-                worst_move = max(moves_data, key=lambda x: x["recursiveScoreBlack"])
-            else:  # Black to move
-                worst_move = max(moves_data, key=lambda x: x["recursiveScoreWhite"])
-
-            return worst_move["moveSAN"]
-
+    moves_data = bundle_moves(position, elo)
+    if moves_data is None:
         return None
-    except (requests.RequestException, KeyError, ValueError):
+    try:
+        # For WHITE, pick move maximizing opponent's recursiveScoreBlack
+        # For BLACK, pick move maximizing opponent's recursiveScoreWhite
+        if color is True:  # White to move
+            worst_move = max(moves_data, key=lambda x: x["recursiveScoreBlack"])
+        else:  # Black to move
+            worst_move = max(moves_data, key=lambda x: x["recursiveScoreWhite"])
+
+        return move_notation(worst_move)
+    except (KeyError, ValueError):
         return None
 
 
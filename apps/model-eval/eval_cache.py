@@ -0,0 +1,83 @@
+import os
+import sqlite3
+import threading
+
+# Position hashing and the LRU cache are shared with the API
+import api_modules  # noqa: F401
+from cache import MISSING, LRUCache
+from chess_hash import board_hash
+
+BUSY_TIMEOUT = 30
+SCHEMA = """CREATE TABLE IF NOT EXISTS evaluation (
+    positionID BLOB NOT NULL,
+    searchLimit TEXT NOT NULL,
+    engine TEXT NOT NULL,
+    score INTEGER,
+    PRIMARY KEY (positionID, searchLimit, engine)
+) WITHOUT ROWID"""
+
+
+class EvalCache:
+    """
+    Engine evaluations keyed by (position hash, search limit, engine name),
+    stored in a SQLite file with an in-memory LRU in front. A score of None
+    (no score reported) is cached like any other. The file is in WAL mode,
+    so worker processes sharing it read while one writes; every thread and
+    process opens its own connection.
+    """
+
+    def __init__(self, file, max_entries=100000, max_bytes=64 * 1024 * 1024):
+        self.file = file
+        self.memory = LRUCache(max_entries, max_bytes)
+        self.local = threading.local()
+        self.disk_hits = 0
+        self.stored = 0
+        # Create the table up front, so a bad path fails before any game
+        self.connect()
+
+    def connect(self):
+        """This thread's connection, opened and set up on first use."""
+        connection = getattr(self.local, "connection", None)
+        # A connection inherited through fork must not be used by the child
+        if connection is None or self.local.pid != os.getpid():
+            connection = sqlite3.connect(self.file, timeout=BUSY_TIMEOUT)
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = NORMAL")
+            with connection:
+                connection.execute(SCHEMA)
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return connection
+
+    def key(self, board, limit, engine):
+        return board_hash(board).to_bytes(16, byteorder="little"), repr(limit), engine
+
+    def get(self, key):
+        """Cached score for a key(), or MISSING."""
+        value = self.memory.get(key)
+        if value is not MISSING:
+            return value
+        row = self.connect().execute(
+            "SELECT score FROM evaluation WHERE positionID = ? AND searchLimit = ? AND engine = ?",
+            key,
+        ).fetchone()
+        if row is None:
+            return MISSING
+        self.disk_hits += 1
+        self.memory.put(key, row[0])
+        return row[0]
+
+    def put(self, key, value):
+        self.memory.put(key, value)
+        with self.connect() as connection:
+            connection.execute("INSERT OR REPLACE INTO evaluation VALUES (?, ?, ?, ?)", (*key, value))
+        self.stored += 1
+
+    def close(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is not None and self.local.pid == os.getpid():
+            connection.close()
+        self.local = threading.local()
+
+    def stats(self):
+        return dict(self.memory.stats(), diskHits=self.disk_hits, stored=self.stored)
@@ -0,0 +1,67 @@
+import json
+import os
+import sqlite3
+
+CHECKPOINT_FILE = "checkpoint.sqlite"
+BUSY_TIMEOUT = 30
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS run (settings TEXT NOT NULL)",
+    """CREATE TABLE IF NOT EXISTS game (
+    recursiveRating INTEGER NOT NULL,
+    avgRating INTEGER NOT NULL,
+    game INTEGER NOT NULL,
+    series TEXT NOT NULL,
+    PRIMARY KEY (recursiveRating, avgRating, game)
+) WITHOUT ROWID""",
+)
+
+
+class GridCheckpoint:
+    """
+    Finished games of a grid run, one row per (pairing, game) in the grid
+    directory's checkpoint.sqlite, committed as each game ends. A rerun
+    over the same directory skips the stored games. The run settings are
+    stored too, and a directory written with other settings is refused
+    (ValueError) so that one grid never mixes two kinds of games.
+    """
+
+    def __init__(self, grid_dir, settings):
+        self.file = os.path.join(grid_dir, CHECKPOINT_FILE)
+        self.connection = sqlite3.connect(self.file, timeout=BUSY_TIMEOUT)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        settings = json.dumps(settings, sort_keys=True)
+        with self.connection as connection:
+            for statement in SCHEMA:
+                connection.execute(statement)
+            row = connection.execute("SELECT settings FROM run").fetchone()
+            if row is None:
+                connection.execute("INSERT INTO run VALUES (?)", (settings,))
+        if row is not None and row[0] != settings:
+            self.connection.close()
+            raise ValueError(
+                f"{self.file} belongs to a grid run with other settings, "
+                "use a new grid directory or delete it to start over."
+            )
+
+    def finished(self):
+        """(recursive rating, avg rating, game) of every stored game."""
+        return set(self.connection.execute("SELECT recursiveRating, avgRating, game FROM game"))
+
+    def put(self, recursive_rating, avg_rating, game, series):
+        with self.connection as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO game VALUES (?, ?, ?, ?)",
+                (recursive_rating, avg_rating, game, json.dumps(series)),
+            )
+
+    def series(self, recursive_rating, avg_rating):
+        """Stored series of one pairing, in game order."""
+        rows = self.connection.execute(
+            "SELECT series FROM game WHERE recursiveRating = ? AND avgRating = ? ORDER BY game",
+            (recursive_rating, avg_rating),
+        )
+        return [json.loads(row[0]) for row in rows]
+
+    def close(self):
+        self.connection.close()
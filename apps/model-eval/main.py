@@ -1,9 +1,19 @@
 # KI-generierter code
 import argparse
 import csv
+from async_runner import DEFAULT_IN_FLIGHT, AsyncGameRunner
 import chess
+import data_source
 import engines
+import multiprocessing.util
 import os
+import random
+import selfplay_runner
+import sys
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from grid_checkpoint import GridCheckpoint
+from selfplay_runner import SelfPlayRunner
 
 GRID_ELO_LEVELS = range(5)  # 0-3 inclusive for 16 pairings
 
@@ -75,6 +85,18 @@ def play_game(
         if max_moves is not None and move_count >= max_moves:
             break
 
+        # Fetch this ply's database lookups of both ratings with one request
+        ply_elos = []
+        if not record_move_frequency and eval_function is engines.eval_pos_avg:
+            ply_elos.append(evaluated_elo)
+        if board.turn == evaluated_color:
+            mover_fn, mover_elo = evaluated_fn, evaluated_elo
+        else:
+            mover_fn, mover_elo = baseline_fn, baseline_elo
+        if mover_fn is not engines.sf_best_move:
+            ply_elos.append(mover_elo)
+        engines.prefetch_bundles(board, ply_elos)
+
         # When not recording frequency, evaluate the position BEFORE making the move
         if not record_move_frequency:
             if eval_function is engines.eval_pos_avg:
@@ -127,7 +149,7 @@ def play_game(
     return evaluations
 
 
-def play_games_for_openings(
+def game_jobs(
     evaluated_fn,
     baseline_fn,
     eval_function,
@@ -139,35 +161,235 @@ def play_games_for_openings(
     status_prefix="",
     max_moves=None,
 ):
+    """
+    One job per opening, alternating the evaluated engine's colour. Jobs
+    only hold module-level functions and plain values, so they can be sent
+    to worker processes.
+    """
     prefix = f"{status_prefix} " if status_prefix else ""
     total_games = len(openings)
-    results = []
+    jobs = []
     for i, base_fen in enumerate(openings):
         evaluated_color = chess.WHITE if i % 2 == 0 else chess.BLACK
-        print(
-            f"{prefix}Game {i+1}/{total_games}: Evaluated plays as {'White' if evaluated_color == chess.WHITE else 'Black'}"
-        )
-        fen = base_fen
-        if generate_openings:
-            fen = generate_opening_fen(
-                moves=4,
-                avg_engine_fn=engines.ENGINE_FUNCTIONS["avg_player"],
-                elo=baseline_elo,
-            )
-        results.append(
-            play_game(
+        status = f"{prefix}Game {i+1}/{total_games}: Evaluated plays as {'White' if evaluated_color == chess.WHITE else 'Black'}"
+        jobs.append(
+            (
+                status,
                 evaluated_fn,
                 baseline_fn,
                 eval_function,
-                fen,
+                base_fen,
                 evaluated_color,
                 evaluated_elo,
                 baseline_elo,
-                record_move_frequency=record_move_frequency,
-                max_moves=max_moves,
+                generate_openings,
+                record_move_frequency,
+                max_moves,
             )
         )
-    return results
+    return jobs
+
+
+def play_job(job):
+    (
+        status,
+        evaluated_fn,
+        baseline_fn,
+        eval_function,
+        fen,
+        evaluated_color,
+        evaluated_elo,
+        baseline_elo,
+        generate_openings,
+        record_move_frequency,
+        max_moves,
+    ) = job
+    print(status)
+    if generate_openings:
+        fen = generate_opening_fen(
+            moves=4,
+            avg_engine_fn=engines.ENGINE_FUNCTIONS["avg_player"],
+            elo=baseline_elo,
+        )
+    return play_game(
+        evaluated_fn,
+        baseline_fn,
+        eval_function,
+        fen,
+        evaluated_color,
+        evaluated_elo,
+        baseline_elo,
+        record_move_frequency=record_move_frequency,
+        max_moves=max_moves,
+    )
+
+
+def run_jobs(jobs, executor=None):
+    """
+    Play jobs in order, on a process pool, concurrently on an
+    AsyncGameRunner or server-side on a SelfPlayRunner; results are in job
+    order either way.
+    """
+    if executor is None:
+        return map(play_job, jobs)
+    if isinstance(executor, (AsyncGameRunner, SelfPlayRunner)):
+        return iter(executor.play(jobs))
+    return executor.map(play_job, jobs)
+
+
+def run_jobs_unordered(jobs, done, executor=None):
+    """
+    run_jobs, calling done(index, result) for every job as soon as it
+    finishes instead of returning the results in job order.
+    """
+    if executor is None:
+        for i, job in enumerate(jobs):
+            done(i, play_job(job))
+    elif isinstance(executor, (AsyncGameRunner, SelfPlayRunner)):
+        executor.play(jobs, done)
+    else:
+        futures = {executor.submit(play_job, job): i for i, job in enumerate(jobs)}
+        for future in as_completed(futures):
+            done(futures[future], future.result())
+
+
+def init_worker(sf_threads, sf_hash, eval_cache, source_options):
+    """
+    Give each worker process its own engine, eval cache connection and data
+    source (API session or in-process model), and its own random sequence
+    (forked workers would otherwise all sample the same moves).
+    """
+    random.seed()
+    engines.configure_engine_pool(1, sf_threads, sf_hash)
+    engines.configure_eval_cache(eval_cache)
+    engines.configure_data_source(**source_options)
+    # Worker processes never return to the __main__ block, close at exit
+    multiprocessing.util.Finalize(None, engines.close_data_source, exitpriority=10)
+    multiprocessing.util.Finalize(None, engines.close_eval_cache, exitpriority=10)
+    multiprocessing.util.Finalize(None, engines.close_engine_pool, exitpriority=10)
+
+
+def play_games_for_openings(
+    evaluated_fn,
+    baseline_fn,
+    eval_function,
+    openings,
+    evaluated_elo,
+    baseline_elo,
+    generate_openings,
+    record_move_frequency,
+    status_prefix="",
+    max_moves=None,
+    executor=None,
+):
+    jobs = game_jobs(
+        evaluated_fn,
+        baseline_fn,
+        eval_function,
+        openings,
+        evaluated_elo,
+        baseline_elo,
+        generate_openings,
+        record_move_frequency,
+        status_prefix=status_prefix,
+        max_moves=max_moves,
+    )
+    return list(run_jobs(jobs, executor))
+
+
+def play_recursive_avg_grid(
+    grid_dir,
+    eval_function,
+    openings,
+    generate_openings,
+    record_move_frequency,
+    max_moves=None,
+    executor=None,
+    settings=None,
+):
+    """
+    Play recursive_best against avg_player for every pair of GRID_ELO_LEVELS
+    and write one CSV per pairing. Every (pairing, game) is a job of its
+    own and all of them are queued at once, so workers stay busy across
+    pairings. Each finished game is stored in the grid's GridCheckpoint
+    right away and a pairing's CSV is written once all its games are in,
+    so an interrupted run continues where it stopped when started again.
+    `settings` are further run settings the checkpoint must match, such as
+    where the games are played.
+    """
+    os.makedirs(grid_dir, exist_ok=True)
+    try:
+        checkpoint = GridCheckpoint(
+            grid_dir,
+            {
+                "eval": eval_function.__name__,
+                "openings": list(openings),
+                "generateOpenings": generate_openings,
+                "recordMoveFrequency": record_move_frequency,
+                "maxMoves": max_moves,
+                **(settings or {}),
+            },
+        )
+    except ValueError as e:
+        # Nothing was played, fail the run rather than report it done
+        sys.exit(str(e))
+    try:
+        grid_pairs = len(GRID_ELO_LEVELS) ** 2
+        finished = checkpoint.finished()
+        print(
+            f"Running recursive vs avg grid ({grid_pairs} pairings) with {len(openings)} games each, "
+            f"{len(finished)} of {grid_pairs * len(openings)} games already done..."
+        )
+        recursive_fn = engines.ENGINE_FUNCTIONS["recursive_best"]
+        avg_fn = engines.ENGINE_FUNCTIONS["avg_player"]
+        tasks = []
+        jobs = []
+        for recursive_elo in GRID_ELO_LEVELS:
+            for avg_elo in GRID_ELO_LEVELS:
+                status = f"[rec {recursive_elo} vs avg {avg_elo}]"
+                pairing_jobs = game_jobs(
+                    recursive_fn,
+                    avg_fn,
+                    eval_function,
+                    openings,
+                    recursive_elo,
+                    avg_elo,
+                    generate_openings,
+                    record_move_frequency,
+                    status_prefix=status,
+                    max_moves=max_moves,
+                )
+                for game, job in enumerate(pairing_jobs):
+                    if (recursive_elo, avg_elo, game) not in finished:
+                        tasks.append((recursive_elo, avg_elo, game))
+                        jobs.append(job)
+        remaining = Counter((recursive_elo, avg_elo) for recursive_elo, avg_elo, _ in tasks)
+        # Also covers pairings finished by a run that stopped before writing them
+        for recursive_elo in GRID_ELO_LEVELS:
+            for avg_elo in GRID_ELO_LEVELS:
+                if not remaining[recursive_elo, avg_elo]:
+                    write_grid_csv(grid_dir, checkpoint, recursive_elo, avg_elo)
+
+        def done(index, series):
+            recursive_elo, avg_elo, game = tasks[index]
+            checkpoint.put(recursive_elo, avg_elo, game, series)
+            remaining[recursive_elo, avg_elo] -= 1
+            if not remaining[recursive_elo, avg_elo]:
+                write_grid_csv(grid_dir, checkpoint, recursive_elo, avg_elo)
+
+        run_jobs_unordered(jobs, done, executor)
+    finally:
+        checkpoint.close()
+
+
+def write_grid_csv(grid_dir, checkpoint, recursive_elo, avg_elo):
+    outfile = os.path.join(grid_dir, f"recursive_{recursive_elo}_avg_{avg_elo}.csv")
+    # Write the whole file aside first, a crash never leaves half a CSV
+    with open(outfile + ".tmp", "w", newline="") as f:
+        writer = csv.writer(f)
+        for row in checkpoint.series(recursive_elo, avg_elo):
+            writer.writerow(row)
+    os.replace(outfile + ".tmp", outfile)
 
 
 def main():
@@ -237,7 +459,7 @@ def main():
     parser.add_argument(
         "--recursive-avg-grid-dir",
         type=str,
-        help="Write recursive-vs-avg pairings to a directory of CSV files (16 total).",
+        help="Write recursive-vs-avg pairings to a directory of CSV files (25 total); rerunning with the same directory resumes an interrupted run.",
     )
     parser.add_argument(
         "--max-moves",
@@ -245,7 +467,114 @@ def main():
         help="Maximum number of moves per game (stops game early if reached).",
     )
 
+    parser.add_argument(
+        "--sf-engines",
+        type=int,
+        default=1,
+        help="Number of long-lived Stockfish processes shared by the sf engine and eval (default: 1).",
+    )
+    parser.add_argument(
+        "--sf-threads",
+        type=int,
+        default=1,
+        help="Threads per Stockfish process (default: 1).",
+    )
+    parser.add_argument(
+        "--sf-hash",
+        type=int,
+        default=16,
+        help="Hash table size per Stockfish process in MB (default: 16).",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Play games on this many processes, each with its own engine and API session (default: 1).",
+    )
+    parser.add_argument(
+        "--async-games",
+        action="store_true",
+        help="Play all games concurrently in one process over a shared keep-alive API client (overrides --workers).",
+    )
+    parser.add_argument(
+        "--in-flight",
+        type=int,
+        default=DEFAULT_IN_FLIGHT,
+        help=f"Maximum concurrent API requests with --async-games (default: {DEFAULT_IN_FLIGHT}).",
+    )
+    parser.add_argument(
+        "--server-side",
+        action="store_true",
+        help="Play each pairing with one self-play call on the data source, overriding --workers and --async-games (database engines with --eval avg or --record-move-frequency only).",
+    )
+    parser.add_argument(
+        "--server-requests",
+        type=int,
+        default=selfplay_runner.DEFAULT_REQUESTS,
+        help=f"Pairings played at once with --server-side; match the API's DB_WORKERS (default: {selfplay_runner.DEFAULT_REQUESTS}).",
+    )
+    parser.add_argument(
+        "--data-source",
+        type=str,
+        default="http",
+        choices=["http", *data_source.BACKENDS],
+        help="Where database engines look positions up: the API over HTTP, or the model file in-process with an API backend (default: http).",
+    )
+    parser.add_argument(
+        "--model",
+        type=str,
+        default=data_source.MODEL_FILE,
+        help=f"Model file for in-process data sources (default: {data_source.MODEL_FILE}).",
+    )
+    parser.add_argument(
+        "--api-url",
+        type=str,
+        default=engines.API_BASE_URL,
+        help=f"API base URL for --data-source http (default: {engines.API_BASE_URL}).",
+    )
+    parser.add_argument(
+        "--api-retries",
+        type=int,
+        default=3,
+        help="Retries with exponential backoff for failed or overloaded API requests (default: 3).",
+    )
+    parser.add_argument(
+        "--api-cache",
+        type=str,
+        help="SQLite file caching API responses across runs; delete it when the model changes.",
+    )
+    parser.add_argument(
+        "--eval-cache",
+        type=str,
+        default="eval_cache.sqlite",
+        help="SQLite file caching Stockfish evaluations (--eval sf) across games and runs; empty to disable (default: eval_cache.sqlite).",
+    )
+
     args = parser.parse_args()
+    if args.async_games and args.data_source != "http":
+        parser.error("--async-games plays over HTTP and needs --data-source http")
+    if args.server_side and not selfplay_runner.supports(
+        engines.ENGINE_FUNCTIONS["recursive_best" if args.recursive_avg_grid_dir else args.evaluated],
+        engines.ENGINE_FUNCTIONS["avg_player" if args.recursive_avg_grid_dir else args.baseline],
+        engines.EVAL_FUNCTIONS[args.eval],
+        args.record_move_frequency,
+    ):
+        parser.error("--server-side needs database engines and --eval avg or --record-move-frequency")
+    engines.configure_engine_pool(args.sf_engines, args.sf_threads, args.sf_hash)
+    # Only Stockfish evals are cached, do not create the file for other runs
+    eval_cache = args.eval_cache if args.eval == "sf" and not args.record_move_frequency else None
+    engines.configure_eval_cache(eval_cache)
+    engines.API_BASE_URL = args.api_url
+    if args.data_source == "http":
+        source_options = {
+            "base_url": args.api_url,
+            "retries": args.api_retries,
+            "cache_file": args.api_cache,
+        }
+    else:
+        source_options = {"file": args.model}
+    source_options["source"] = args.data_source
+    engines.configure_data_source(**source_options)
 
     # Re-added: map CLI names to actual engine/eval callables
     evaluated_fn = engines.ENGINE_FUNCTIONS[args.evaluated]
@@ -271,51 +600,55 @@ def main():
     if not openings_to_play:
         print("No openings available.")
         return
-    if args.recursive_avg_grid_dir:
-        os.makedirs(args.recursive_avg_grid_dir, exist_ok=True)
-        grid_pairs = len(GRID_ELO_LEVELS) ** 2
-        print(
-            f"Running recursive vs avg grid ({grid_pairs} pairings) with {len(openings_to_play)} games each..."
+    executor = None
+    if args.server_side:
+        print(f"Playing each pairing with one server-side self-play call, {args.server_requests} at once.")
+        executor = SelfPlayRunner(requests=args.server_requests)
+    elif args.async_games:
+        print(f"Playing games concurrently with up to {args.in_flight} API requests in flight.")
+        executor = AsyncGameRunner(args.in_flight, args.sf_engines)
+    elif args.workers > 1:
+        print(f"Playing on {args.workers} worker processes.")
+        executor = ProcessPoolExecutor(
+            args.workers,
+            initializer=init_worker,
+            initargs=(args.sf_threads, args.sf_hash, eval_cache, source_options),
         )
-        recursive_fn = engines.ENGINE_FUNCTIONS["recursive_best"]
-        avg_fn = engines.ENGINE_FUNCTIONS["avg_player"]
-        for recursive_elo in GRID_ELO_LEVELS:
-            for avg_elo in GRID_ELO_LEVELS:
-                status = f"[rec {recursive_elo} vs avg {avg_elo}]"
-                series = play_games_for_openings(
-                    recursive_fn,
-                    avg_fn,
-                    eval_function,
-                    openings_to_play,
-                    recursive_elo,
-                    avg_elo,
-                    args.generate_openings,
-                    args.record_move_frequency,
-                    status_prefix=status,
-                    max_moves=args.max_moves,
-                )
-                outfile = os.path.join(
-                    args.recursive_avg_grid_dir,
-                    f"recursive_{recursive_elo}_avg_{avg_elo}.csv",
-                )
-                with open(outfile, "w", newline="") as f:
-                    writer = csv.writer(f)
-                    for row in series:
-                        writer.writerow(row)
-        print("Done.")
-        return
-    print(f"Playing {len(openings_to_play)} games...")
-    all_game_evals = play_games_for_openings(
-        evaluated_fn,
-        baseline_fn,
-        eval_function,
-        openings_to_play,
-        args.evaluated_elo,
-        args.baseline_elo,
-        args.generate_openings,
-        args.record_move_frequency,
-        max_moves=args.max_moves,
-    )
+    try:
+        if args.recursive_avg_grid_dir:
+            play_recursive_avg_grid(
+                args.recursive_avg_grid_dir,
+                eval_function,
+                openings_to_play,
+                args.generate_openings,
+                args.record_move_frequency,
+                args.max_moves,
+                executor,
+                {
+                    "serverSide": args.server_side,
+                    "dataSource": args.data_source,
+                    "model": None if args.data_source == "http" else args.model,
+                },
+            )
+            print("Done.")
+            return
+        print(f"Playing {len(openings_to_play)} games...")
+        all_game_evals = play_games_for_openings(
+            evaluated_fn,
+            baseline_fn,
+            eval_function,
+            openings_to_play,
+            args.evaluated_elo,
+            args.baseline_elo,
+            args.generate_openings,
+            args.record_move_frequency,
+            max_moves=args.max_moves,
+            executor=executor,
+        )
+    finally:
+        if isinstance(executor, ProcessPoolExecutor):
+            # Queued games of an interrupted grid are played on the next run
+            executor.shutdown(cancel_futures=True)
 
     print(f"Saving results to {args.output}...")
     with open(args.output, "w", newline="") as f:
@@ -327,4 +660,12 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    finally:
+        stats = engines.data_source_stats()
+        if stats is not None:
+            print(f"Data source: {stats}")
+        engines.close_data_source()
+        engines.close_eval_cache()
+        engines.close_engine_pool()
@@ -0,0 +1,105 @@
+import itertools
+import random
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import chess
+
+import engines
+from async_runner import STRATEGY_NAMES
+
+# Pairings sent to the data source at once
+DEFAULT_REQUESTS = 4
+
+
+def supports(evaluated_fn, baseline_fn, eval_function, record_move_frequency):
+    """Whether games with these engines can be played by selfplay()."""
+    return (
+        evaluated_fn in STRATEGY_NAMES
+        and baseline_fn in STRATEGY_NAMES
+        and (record_move_frequency or eval_function is engines.eval_pos_avg)
+    )
+
+
+def pairing(job):
+    """A job (see main.game_jobs) without its status, opening and colour."""
+    return job[1:4] + job[6:]
+
+
+def batches(jobs):
+    """
+    Runs of jobs of one pairing with alternating colours, as the server
+    plays them. A full pairing is one batch; the jobs left of a resumed
+    pairing can need several.
+    """
+    for _, group in itertools.groupby(jobs, key=pairing):
+        batch = []
+        for job in group:
+            if batch and job[5] == batch[-1][5]:
+                yield batch
+                batch = []
+            batch.append(job)
+        yield batch
+
+
+class SelfPlayRunner:
+    """
+    Plays game jobs (see main.game_jobs) with the data source's selfplay():
+    the consecutive jobs of one pairing become a single POST /selfplay, or a
+    single in-process call for a local model. Up to `requests` pairings are
+    played at once, so a server with several DB_WORKERS plays them in
+    parallel. With `done`, done(index, result) is called for each game once
+    its pairing is back.
+    """
+
+    def __init__(self, seed=None, requests=DEFAULT_REQUESTS):
+        self.rng = random.Random(seed)
+        self.requests = requests
+
+    def play_batch(self, group, seed):
+        """Results of one batch (see batches()) of jobs."""
+        (
+            _,
+            evaluated_fn,
+            baseline_fn,
+            _,
+            _,
+            _,
+            evaluated_elo,
+            baseline_elo,
+            generate_openings,
+            record_move_frequency,
+            max_moves,
+        ) = group[0]
+        series = engines.data_source().selfplay(
+            evaluated=STRATEGY_NAMES[evaluated_fn],
+            baseline=STRATEGY_NAMES[baseline_fn],
+            evaluated_rating=evaluated_elo,
+            baseline_rating=baseline_elo,
+            openings=[job[4] for job in group],
+            series="frequency" if record_move_frequency else "avg",
+            generate_openings=generate_openings,
+            max_moves=max_moves,
+            seed=seed,
+            first_game=0 if group[0][5] == chess.WHITE else 1,
+        )
+        if not isinstance(series, list) or len(series) != len(group):
+            raise RuntimeError(f"Self-play failed: {series}")
+        return series
+
+    def play(self, jobs, done=None):
+        """Results of all jobs, in job order."""
+        results = [None] * len(jobs)
+        with ThreadPoolExecutor(self.requests) as pool:
+            futures = {}
+            index = 0
+            for group in batches(jobs):
+                print(f"{group[0][0]} (+{len(group) - 1} more, server-side)")
+                # Seeds are drawn in job order, whichever batch finishes first
+                futures[pool.submit(self.play_batch, group, self.rng.getrandbits(32))] = index
+                index += len(group)
+            for future in as_completed(futures):
+                for index, result in enumerate(future.result(), futures[future]):
+                    if done is not None:
+                        done(index, result)
+                    results[index] = result
+        return results
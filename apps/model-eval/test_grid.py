@@ -0,0 +1,57 @@
+"""
+Resuming grid runs: GridCheckpoint and the server-side batches of a
+partly played pairing.
+
+    python -m pytest apps/model-eval/test_grid.py
+"""
+import chess
+import pytest
+
+import engines
+from grid_checkpoint import GridCheckpoint
+from selfplay_runner import batches
+
+SETTINGS = {"eval": "eval_pos_avg", "openings": [chess.STARTING_FEN], "maxMoves": None}
+
+
+def test_checkpoint_resumes(tmp_path):
+    checkpoint = GridCheckpoint(str(tmp_path), SETTINGS)
+    checkpoint.put(1, 2, 1, [0.5])
+    checkpoint.put(1, 2, 0, [0.25, 0.75])
+    checkpoint.put(2, 1, 0, [1.0])
+    checkpoint.close()
+
+    checkpoint = GridCheckpoint(str(tmp_path), dict(SETTINGS))
+    assert checkpoint.finished() == {(1, 2, 0), (1, 2, 1), (2, 1, 0)}
+    assert checkpoint.series(1, 2) == [[0.25, 0.75], [0.5]]
+    assert checkpoint.series(3, 3) == []
+    checkpoint.close()
+
+
+def test_checkpoint_other_settings(tmp_path):
+    GridCheckpoint(str(tmp_path), SETTINGS).close()
+    with pytest.raises(ValueError):
+        GridCheckpoint(str(tmp_path), {**SETTINGS, "maxMoves": 40})
+
+
+def job(game, color, evaluated_elo=1):
+    return (
+        f"Game {game}",
+        engines.ENGINE_FUNCTIONS["recursive_best"],
+        engines.ENGINE_FUNCTIONS["avg_player"],
+        engines.eval_pos_avg,
+        chess.STARTING_FEN,
+        color,
+        evaluated_elo,
+        2,
+        False,
+        False,
+        None,
+    )
+
+
+def test_batches():
+    # Games 0 and 3 of the first pairing are done, colours alternate
+    first = [job(1, chess.BLACK), job(2, chess.WHITE), job(4, chess.WHITE), job(5, chess.BLACK)]
+    second = [job(game, color, 2) for game, color in enumerate([chess.WHITE, chess.BLACK] * 2)]
+    assert list(batches(first + second)) == [first[:2], first[2:], second]